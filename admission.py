@@ -0,0 +1,134 @@
+import os
+import heapq
+import itertools
+import threading
+import psutil
+import metrics
+from multiplexer import MUX_BROWSERS
+
+# Configuration Constants
+MIN_FREE_MEMORY_MB = int(os.getenv("ADMISSION_MIN_FREE_MB", "512"))  # Host memory left free after a new session's share
+MAX_CPU_PERCENT = int(os.getenv("ADMISSION_MAX_CPU", "85"))  # No launches while the host CPU is busier than this
+BROWSER_SESSION_MB = int(os.getenv("ADMISSION_BROWSER_MB", "300"))  # Assumed browser size until real ones have been measured
+LIGHT_SESSION_MB = 30  # HTTP and multiplexed sessions start no browser of their own
+ADMISSION_INTERVAL = 5  # Seconds between capacity checks while launches are waiting
+MB = 1024 * 1024
+
+# Host CPU use in percent, as the one-minute load average per core. cpu_percent(interval=None) would only
+# cover the milliseconds since the previous check, which are mostly the caller's own work.
+def cpu_load():
+    return psutil.getloadavg()[0] / (psutil.cpu_count() or 1) * 100
+
+# Decides whether the host can take one more session, and keeps the launches it cannot take in line.
+# Waiting launches are ordered by priority (the start of the user's lesson) and admitted strictly in that order
+# as sessions end or memory and CPU free up. Sessions are identified by a key, e.g. the user ID or job ID.
+class AdmissionController:
+    def __init__(self, max_sessions):
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._live = {}  # key -> [engine, browser pids or None while starting]
+        self._heap = []  # (priority, sequence, key)
+        self._waiting = {}  # key -> (sequence, engine, item)
+        self._sequence = itertools.count()
+        metrics.register_collector(self._metrics)
+
+    def _light(self, engine):
+        return engine == "http" or MUX_BROWSERS > 0
+
+    def _rss(self, pids):
+        rss = 0
+        for pid in pids:
+            try:
+                rss += psutil.Process(pid).memory_info().rss
+            except psutil.Error:
+                pass
+        return rss
+
+    # Memory a new session is expected to take, from the browsers running now when there are any
+    def estimate(self, engine):
+        if self._light(engine):
+            return LIGHT_SESSION_MB
+        measured = [self._rss(pids) for _, pids in self._live.values() if pids]
+        measured = [rss for rss in measured if rss]
+        return sum(measured) / len(measured) / MB if measured else BROWSER_SESSION_MB
+
+    def has_capacity(self, engine="selenium"):
+        with self._lock:
+            return self._fits(engine)
+
+    def _fits(self, engine):
+        if len(self._live) >= self.max_sessions:
+            return False
+        if cpu_load() > MAX_CPU_PERCENT:
+            return False
+        # Browsers still starting do not show in the host's free memory yet
+        starting = sum(1 for live_engine, pids in self._live.values() if pids is None and not self._light(live_engine))
+        available = psutil.virtual_memory().available / MB - starting * self.estimate("selenium")
+        return available - self.estimate(engine) >= MIN_FREE_MEMORY_MB
+
+    # Put a launch in line; admit() hands it back once it can run
+    def enqueue(self, key, engine, priority, item):
+        with self._lock:
+            sequence = next(self._sequence)
+            self._waiting[key] = (sequence, engine, item)
+            heapq.heappush(self._heap, (priority, sequence, key))
+
+    # Waiting launches that can start now, best priority first; they count as live from here on
+    def admit(self):
+        admitted = []
+        with self._lock:
+            while self._heap:
+                _, sequence, key = self._heap[0]
+                waiting = self._waiting.get(key)
+                if waiting is None or waiting[0] != sequence:
+                    heapq.heappop(self._heap)  # Cancelled or enqueued again
+                    continue
+                if not self._fits(waiting[1]):
+                    break
+                heapq.heappop(self._heap)
+                del self._waiting[key]
+                self._live[key] = [waiting[1], None]
+                admitted.append(waiting[2])
+        if admitted:
+            metrics.inc("admitted_sessions", len(admitted))
+        return admitted
+
+    # Record a session that was admitted elsewhere, e.g. a job a worker claimed after has_capacity()
+    def started(self, key, engine):
+        with self._lock:
+            self._live[key] = [engine, None]
+
+    def set_browsers(self, key, pids):
+        with self._lock:
+            if key in self._live:
+                self._live[key][1] = list(pids)
+
+    def finished(self, key):
+        with self._lock:
+            self._live.pop(key, None)
+
+    def discard(self, key):
+        with self._lock:
+            return self._waiting.pop(key, None) is not None
+
+    # 1-based place in line, None when not waiting
+    def position(self, key):
+        with self._lock:
+            waiting = self._waiting.get(key)
+            if waiting is None:
+                return None
+            entries = sorted(entry for entry in self._heap if self._waiting.get(entry[2], (None,))[0] == entry[1])
+            return 1 + [entry[2] for entry in entries].index(key)
+
+    def waiting_count(self):
+        return len(self._waiting)
+
+    def _metrics(self):
+        with self._lock:
+            live = [pids for _, pids in self._live.values()]
+        return {
+            "admission_waiting": len(self._waiting),
+            "admission_live": len(live),
+            "sessions_browser_memory_bytes": sum(self._rss(pids) for pids in live if pids),
+            "host_available_memory_bytes": psutil.virtual_memory().available,
+        }
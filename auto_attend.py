@@ -1,50 +1,148 @@
+import startup
+import os
 import time
 import sys
-import requests
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service as ChromeService
-from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.common.by import By
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from db import get_user_credentials
-from bot import send_notification  # Import the function from bot.py
+from db import get_user_credentials, get_portal_session, save_portal_session
+from notifier import send_notification
+from scheduler import PollScheduler
+import metrics
+from portal_health import portal_health, next_delay
+from browser import PORTAL_URL, MAX_BROWSER_RSS_MB, create_driver, quit_driver, over_memory_cap, browser_pids
+
+startup.mark("imports")
 
 # Configuration Constants
 WAIT_TIME = 20  # Increased wait time
 UPDATE_INTERVAL = 60
-SHOW_UI = True
+DETECTION_MODE = os.getenv("DETECTION_MODE", "observer")  # "observer" watches the page in-browser, "legacy" scans page_source
+OBSERVE_SLICE = 5  # Longest single in-page watch, so a stop request is noticed quickly
+MAX_SESSION_FAILURES = 10  # Consecutive failed checks that end a session while the portal is fine for others
+
+# Watches the page with a MutationObserver and resolves with a compact status object.
+# Arguments: timeout in ms, whether to click "Отметиться" buttons, whether to resolve only when buttons appear.
+# On timeout the state is 'no_buttons' when the portal rendered (a lesson without open attendance) and
+# 'pending' when it never did.
+WATCH_SCRIPT = """
+const [timeout, click, buttonsOnly, done] = arguments;
+function settle() {
+    const buttons = [];
+    for (const caption of document.querySelectorAll('span.v-button-caption')) {
+        const button = caption.parentElement && caption.parentElement.parentElement;
+        if (caption.textContent === 'Отметиться' && button && !button.dataset.attended) buttons.push(button);
+    }
+    if (buttons.length) {
+        if (click) buttons.forEach(button => { button.dataset.attended = '1'; button.click(); });
+        return {state: 'buttons', buttons: buttons.length, clicked: click ? buttons.length : 0};
+    }
+    if (buttonsOnly) return null;
+    if (document.querySelector('input[type="password"]')) return {state: 'logged_out', buttons: 0, clicked: 0};
+    if (document.body && document.body.textContent.includes('Нет доступных дисциплин')) {
+        return {state: 'no_courses', buttons: 0, clicked: 0};
+    }
+    return null;
+}
+const status = settle();
+if (status) { done(status); return; }
+let observer;
+const timer = setTimeout(() => {
+    observer.disconnect();
+    const rendered = document.querySelector('.v-widget, .v-button, .v-label');
+    done({state: rendered ? 'no_buttons' : 'pending', buttons: 0, clicked: 0});
+}, timeout);
+observer = new MutationObserver(() => {
+    const status = settle();
+    if (status) { observer.disconnect(); clearTimeout(timer); done(status); }
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, characterData: true});
+"""
 
-# Function to attempt attendance
+# Function to attempt attendance; returns what went wrong when the portal did not answer properly.
+# A loaded page without an "Отметиться" button is normal (attendance not open yet, or already marked).
 def try_to_attend(driver, chat_id, bot_token):
     wait = WebDriverWait(driver, WAIT_TIME)
     page_source = driver.page_source
 
     if 'Нет доступных дисциплин' in page_source:
         print("No available courses found.")
-        return
+        return None
 
     try:
         # Wait for the attendance button to appear
-        button_divs = wait.until(
-            EC.presence_of_all_elements_located(
-                (By.XPATH, "//div[span/span[@class='v-button-caption' and text()='Отметиться']]")
+        with metrics.span("button_detection"):
+            button_divs = wait.until(
+                EC.presence_of_all_elements_located(
+                    (By.XPATH, "//div[span/span[@class='v-button-caption' and text()='Отметиться']]")
+                )
             )
-        )
 
         # Click on each button to attempt attendance
         for button_div in button_divs:
             if button_div:
-                button_div.click()
+                with metrics.span("button_click"):
+                    button_div.click()
+                metrics.inc("attendance_marks")
                 time.sleep(1)
                 send_notification(chat_id, "Attendance successful!")
     except TimeoutException:
-        send_notification(chat_id, "Timeout reached, could not mark attendance.")
+        metrics.inc("attendance_timeouts")
         print("Timeout reached, could not mark attendance.")
     except Exception as e:
         print(f"Error during attendance attempt: {e}")
-        send_notification(chat_id, f"Error during attendance attempt: {e}")
+        return f"Error during attendance attempt: {e}"
+    return None
+
+# Run the in-page watcher for up to `timeout` seconds
+def watch_page(driver, timeout, click=True, buttons_only=False):
+    driver.set_script_timeout(timeout + 5)
+    return driver.execute_async_script(WATCH_SCRIPT, int(timeout * 1000), click, buttons_only)
+
+def report_clicks(chat_id, status):
+    metrics.inc("attendance_marks", status["clicked"])
+    for _ in range(status["clicked"]):
+        send_notification(chat_id, "Attendance successful!")
+
+# Function to attempt attendance by watching the page until it settles
+def check_page(driver, chat_id, bot_token):
+    with metrics.span("button_detection"):
+        status = watch_page(driver, WAIT_TIME)
+    if status["state"] == "buttons":
+        report_clicks(chat_id, status)
+    elif status["state"] == "no_courses":
+        print("No available courses found.")
+    elif status["state"] == "no_buttons":
+        metrics.inc("attendance_timeouts")
+        print("Timeout reached, could not mark attendance.")
+    elif status["state"] == "pending":
+        # Reported to the user through portal_health, once per outage
+        print("The portal page did not load.")
+    return status
+
+# Sleep for `delay` seconds; returns True when asked to stop
+def wait_or_stop(delay, stop_event=None):
+    if stop_event is None:
+        time.sleep(delay)
+        return False
+    return stop_event.wait(delay)
+
+# Wait `delay` seconds, clicking any button the page shows meanwhile; returns True when asked to stop
+def idle_watch(driver, chat_id, delay, stop_event=None):
+    end = time.time() + delay
+    while True:
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        if stop_event is not None and stop_event.is_set():
+            return True
+        try:
+            report_clicks(chat_id, watch_page(driver, min(remaining, OBSERVE_SLICE), buttons_only=True))
+        except WebDriverException as e:
+            # The next cycle reloads the page; until then just wait
+            print(f"Error watching the page: {e.msg or type(e).__name__}")
+            return wait_or_stop(max(0, end - time.time()), stop_event)
 
 # Function to login to the website
 def login(selenium_driver, username, password):
@@ -78,49 +176,175 @@ def login(selenium_driver, username, password):
     if submit_button is not None:
         submit_button.click()
 
-# Main function to control the bot
-def main(username, password, duration, chat_id, bot_token):
-    options = webdriver.ChromeOptions()
-    if not SHOW_UI:
-        options.add_argument('--headless')
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
+# Load the user's saved portal cookies into the browser
+def restore_session(driver, user_id):
+    cookies = get_portal_session(user_id)
+    if not cookies:
+        return False
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except Exception as e:
+            print(f"Could not restore cookie {cookie.get('name')}: {e}")
+    driver.refresh()
+    return True
+
+# Log in and store the authenticated cookies for the next run
+def relogin(driver, username, password, user_id):
+    with metrics.span("portal_login"):
+        login(driver, username, password)
+        WebDriverWait(driver, WAIT_TIME).until(EC.invisibility_of_element_located((By.XPATH, '//input[@type="password"]')))
+    save_portal_session(user_id, driver.get_cookies())
 
-    # Use WebDriverManager to get the latest version of chromedriver
-    driver = webdriver.Chrome(service=ChromeService(ChromeDriverManager().install()), options=options)
+# Log in only if the page shows the login form
+def ensure_logged_in(driver, username, password, user_id):
+    if watch_page(driver, WAIT_TIME, click=False)["state"] == "logged_out":
+        relogin(driver, username, password, user_id)
 
+# Replace a browser that outgrew its memory cap with a fresh, logged-in one
+def restart_driver(driver, username, password, user_id, on_browser=None):
+    print(f"Browser for {user_id} exceeded {MAX_BROWSER_RSS_MB} MB, restarting it.")
+    quit_driver(driver)
+    driver = create_driver()
+    if on_browser is not None:
+        on_browser(browser_pids(driver))
     try:
-        # Open the target website
-        driver.get("https://wsp.kbtu.kz/RegistrationOnline")
-        login(driver, username, password)
+        driver.get(PORTAL_URL)
+        restore_session(driver, user_id)
+        ensure_logged_in(driver, username, password, user_id)
+    except Exception:
+        quit_driver(driver)
+        raise
+    return driver
+
+# Main function to control the bot
+# A pooled `driver` is borrowed from the caller and left open; `stop_event` ends the run early.
+# `on_browser` is called with the PIDs of every browser this function starts, so they can be reaped after a crash.
+def main(username, password, duration, chat_id, bot_token, driver=None, stop_event=None, on_browser=None):
+    owns_driver = driver is None
+    if owns_driver:
+        with startup.phase("browser_start"):
+            driver = create_driver()
+        if on_browser is not None:
+            on_browser(browser_pids(driver))
+
+    try:
+        # Open the target website (pooled browsers are already there)
+        if owns_driver:
+            with startup.phase("page_load"):
+                driver.get(PORTAL_URL)
+        # Reuse the saved session when it is still valid
+        with startup.phase("login"):
+            restore_session(driver, chat_id)
+            ensure_logged_in(driver, username, password, chat_id)
 
         # Set the end time based on the duration
         end_time = time.time() + duration * 60
 
-        # Main loop to attempt attendance every `UPDATE_INTERVAL` seconds
+        # Poll densely around the user's lessons, every `UPDATE_INTERVAL` seconds without a timetable
+        poller = PollScheduler.for_user(chat_id, UPDATE_INTERVAL)
+
+        failures = 0  # Consecutive failed checks of this session
+        refresh = False
+
+        # Main loop to attempt attendance
         while time.time() < end_time:
-            try_to_attend(driver, chat_id, bot_token)
-            time.sleep(UPDATE_INTERVAL)
-            driver.refresh()
+            # While the portal is failing for everyone, wait out the shared backoff instead of polling
+            pause = min(portal_health.wait_time(), max(0, end_time - time.time()))
+            if pause > 0:
+                if wait_or_stop(pause, stop_event):
+                    break
+                continue
+            try:
+                if refresh:
+                    with metrics.span("page_refresh"):
+                        driver.refresh()
+                refresh = True
+                if DETECTION_MODE == "legacy":
+                    ensure_logged_in(driver, username, password, chat_id)
+                    problem = try_to_attend(driver, chat_id, bot_token)
+                else:
+                    status = check_page(driver, chat_id, bot_token)
+                    if status["state"] == "logged_out":
+                        # The session expired mid-run
+                        relogin(driver, username, password, chat_id)
+                        refresh = False
+                        continue
+                    problem = "The portal page did not load." if status["state"] == "pending" else None
+            except WebDriverException as e:
+                problem = e.msg or type(e).__name__
+
+            if problem is None:
+                failures = 0
+                portal_health.record_success(chat_id)
+            else:
+                failures += 1
+                portal_health.record_failure(chat_id, problem)
+                if failures >= MAX_SESSION_FAILURES and not portal_health.is_open():
+                    raise RuntimeError(problem)  # The portal works for others, so this session is broken
+            startup.mark("first_poll")
+            startup.emit()
+
+            delay = min(next_delay(poller.next_delay(), failures), max(0, end_time - time.time()))
+            # Watch the open page only around lessons (or always without a timetable); far from a lesson just sleep
+            watch = DETECTION_MODE != "legacy" and problem is None and (not poller.lessons or poller.in_window())
+            if watch:
+                if idle_watch(driver, chat_id, delay, stop_event):
+                    break
+            elif wait_or_stop(delay, stop_event):
+                break
+            if time.time() >= end_time:
+                break
+            if over_memory_cap(driver):
+                # A borrowed browser is quit too; the pool discards it when it comes back
+                driver = restart_driver(driver, username, password, chat_id, on_browser)
+                owns_driver = True
+                refresh = False
 
     except Exception as e:
         send_notification(chat_id, f"An error occurred in the main loop: {e}")
         print(f"Error in main loop: {e}")
     finally:
-        driver.quit()
+        if owns_driver:
+            quit_driver(driver)
+        portal_health.finish(chat_id)
         send_notification(chat_id, "Script execution finished.")
 
+# Run attendance with the chosen engine, falling back to Selenium when the HTTP engine cannot start
+def run(engine, username, password, duration, chat_id, bot_token, driver=None, stop_event=None, on_browser=None):
+    metrics.inc("sessions_started")
+    metrics.add_gauge("active_sessions", 1)
+    try:
+        if engine == "http":
+            try:
+                import http_engine  # Only the HTTP engine needs requests and its Vaadin client
+                return http_engine.main(username, password, duration, chat_id, bot_token, stop_event=stop_event)
+            except Exception as e:
+                metrics.inc("http_engine_fallbacks")
+                print(f"HTTP engine failed to start, falling back to Selenium: {e}")
+        return main(username, password, duration, chat_id, bot_token, driver=driver, stop_event=stop_event, on_browser=on_browser)
+    finally:
+        metrics.add_gauge("active_sessions", -1)
+
 # Entry point of the script
 if __name__ == "__main__":
-    if len(sys.argv) < 6:
-        print("Usage: python auto_attend.py <username> <password> <duration_in_minutes> <chat_id> <bot_token>")
+    ENGINE = "selenium"
+    args = []
+    for arg in sys.argv[1:]:
+        if arg.startswith("--engine="):
+            ENGINE = arg.split("=", 1)[1]
+        elif arg != "--profile-startup":
+            args.append(arg)
+
+    if len(args) < 5 or ENGINE not in ("http", "selenium"):
+        print("Usage: python auto_attend.py [--engine=http|selenium] [--profile-startup] <username> <password> <duration_in_minutes> <chat_id> <bot_token>")
         sys.exit(1)
 
-    USERNAME = sys.argv[1]
-    PASSWORD = sys.argv[2]
-    DURATION = int(sys.argv[3])
-    CHAT_ID = sys.argv[4]
-    BOT_TOKEN = sys.argv[5]
+    USERNAME = args[0]
+    PASSWORD = args[1]
+    DURATION = int(args[2])
+    CHAT_ID = args[3]
+    BOT_TOKEN = args[4]
 
     # Check if the user exists in the database
     if not get_user_credentials(CHAT_ID):
@@ -128,4 +352,4 @@ if __name__ == "__main__":
         send_notification(CHAT_ID, "User does not exist in the database.")
         sys.exit(1)
 
-    main(USERNAME, PASSWORD, DURATION, CHAT_ID, BOT_TOKEN)
+    run(ENGINE, USERNAME, PASSWORD, DURATION, CHAT_ID, BOT_TOKEN)
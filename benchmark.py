@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import psutil
+from mock_portal import MockPortal, start_in_thread
+
+# End-to-end benchmark: runs N concurrent attendance sessions against mock_portal.py and reports
+# time-to-mark, sessions per core, RSS per session and notification latency as JSON.
+
+# Configuration Constants
+BENCH_PORT = int(os.getenv("BENCH_PORT", "8081"))
+SAMPLE_INTERVAL = 0.5  # Seconds between RSS/CPU samples
+SUCCESS_TEXT = "Attendance successful!"
+
+USAGE = "Usage: python benchmark.py [--engine=http|selenium] [--users=10,100,500] [--button-delay=5] [--timeout=120] [--output=bench_results.json] [--compare=previous.json]"
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(fraction * len(values)))], 3)
+
+def summary(values):
+    return {"p50": percentile(values, 0.5), "p95": percentile(values, 0.95), "max": percentile(values, 1.0), "count": len(values)}
+
+# Samples memory and CPU of this process and every browser it starts
+class ResourceSampler:
+    def __init__(self):
+        self.process = psutil.Process()
+        self.peak_rss = 0
+        self.cpu = {}  # pid -> last seen CPU seconds, so exited browsers still count
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        rss = 0
+        for process in [self.process] + self.process.children(recursive=True):
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    times = process.cpu_times()
+                    self.cpu[process.pid] = times.user + times.system
+            except psutil.Error:
+                pass
+        self.peak_rss = max(self.peak_rss, rss)
+        return rss
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+    def cpu_seconds(self):
+        return sum(self.cpu.values())
+
+# Run `users` sessions at once until all of them are marked or the timeout passes
+def run_level(portal, engine, users, timeout):
+    from db import save_user_credentials
+    from auto_attend import run
+
+    portal.reset()
+    sampler = ResourceSampler()
+    baseline_rss = sampler.sample()
+    baseline_cpu = sampler.cpu_seconds()
+    sampler.start()
+
+    sessions = []
+    started = time.time()
+    for index in range(users):
+        chat_id = 100000 + index
+        username = f"bench{chat_id}"
+        save_user_credentials(chat_id, username, "secret")
+        stop_event = threading.Event()
+        thread = threading.Thread(
+            target=run, args=(engine, username, "secret", timeout / 60, chat_id, "bench"),
+            kwargs={"stop_event": stop_event}, daemon=True,
+        )
+        thread.start()
+        sessions.append((chat_id, username, stop_event, thread))
+
+    deadline = started + timeout
+    while time.time() < deadline:
+        marked = sum(1 for _, username, _, _ in sessions if portal.marks.get(username, {}).get("clicked"))
+        if marked == users:
+            break
+        time.sleep(SAMPLE_INTERVAL)
+    for _, _, stop_event, _ in sessions:
+        stop_event.set()
+    for _, _, _, thread in sessions:
+        thread.join(60)
+    wall = time.time() - started
+    sampler.stop()
+
+    time_to_mark = []
+    launch_to_mark = []
+    notification_latency = []
+    for chat_id, username, _, _ in sessions:
+        mark = portal.marks.get(username)
+        if not mark or not mark["clicked"]:
+            continue
+        clicked_at = mark["clicked"][0]
+        time_to_mark.append(clicked_at - mark["appeared"])
+        launch_to_mark.append(clicked_at - started)
+        received = [at for chat, text, at in portal.messages if chat == str(chat_id) and text == SUCCESS_TEXT and at >= clicked_at]
+        if received:
+            notification_latency.append(min(received) - clicked_at)
+
+    cores_used = (sampler.cpu_seconds() - baseline_cpu) / wall
+    return {
+        "users": users,
+        "marked": len(time_to_mark),
+        "wall_seconds": round(wall, 2),
+        "time_to_mark": summary(time_to_mark),
+        "launch_to_mark": summary(launch_to_mark),
+        "notification_latency": summary(notification_latency),
+        "rss_per_session_mb": round((sampler.peak_rss - baseline_rss) / users / (1024 * 1024), 1),
+        "cores_used": round(cores_used, 2),
+        "sessions_per_core": round(users / cores_used, 1) if cores_used > 0 else None,
+        "portal_requests": portal.requests,
+        "logins": portal.logins,
+    }
+
+# Print how each level's headline numbers moved since a previous run
+def compare(previous, current):
+    earlier = {level["users"]: level for level in previous["levels"]}
+    for level in current["levels"]:
+        before = earlier.get(level["users"])
+        if before is None:
+            continue
+        print(f"{level['users']} users:")
+        for name, now, then in (
+            ("time_to_mark p50", level["time_to_mark"]["p50"], before["time_to_mark"]["p50"]),
+            ("notification_latency p50", level["notification_latency"]["p50"], before["notification_latency"]["p50"]),
+            ("rss_per_session_mb", level["rss_per_session_mb"], before["rss_per_session_mb"]),
+            ("sessions_per_core", level["sessions_per_core"], before["sessions_per_core"]),
+        ):
+            if now is not None and then is not None:
+                print(f"  {name}: {then} -> {now} ({now - then:+.3f})")
+
+def main():
+    options = {"engine": "selenium", "users": "10", "button-delay": "5", "timeout": "120", "output": "bench_results.json", "compare": None}
+    for arg in sys.argv[1:]:
+        name, _, value = arg.lstrip("-").partition("=")
+        if name not in options or not value:
+            print(USAGE)
+            return 1
+        options[name] = value
+
+    portal = MockPortal(button_delay=float(options["button-delay"]))
+    base_url = start_in_thread(portal, port=BENCH_PORT)
+    # The attendance modules read these at import time, so they are imported only after this point
+    os.environ["PORTAL_URL"] = base_url + "/RegistrationOnline"
+    os.environ["TELEGRAM_API_URL"] = base_url
+    os.environ["API_TOKEN"] = "bench"
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="bench-"), "bench.db")
+    from db import init_db
+    init_db()
+
+    results = {
+        "engine": options["engine"],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "cpus": psutil.cpu_count(),
+        "button_delay": portal.button_delay,
+        "levels": [],
+    }
+    for users in [int(value) for value in options["users"].split(",")]:
+        print(f"Running {users} sessions with the {options['engine']} engine...")
+        level = run_level(portal, options["engine"], users, float(options["timeout"]))
+        print(json.dumps(level, indent=2))
+        results["levels"].append(level)
+
+    with open(options["output"], "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {options['output']}")
+    if options["compare"]:
+        with open(options["compare"]) as f:
+            compare(json.load(f), results)
+    return 0
+
+# Entry point of the script
+if __name__ == "__main__":
+    sys.exit(main())
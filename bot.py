@@ -1,34 +1,78 @@
 import os
-import subprocess
+import sys
+import time
 import asyncio
-import requests
+import multiprocessing
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
-from db import init_db, save_user_credentials, get_user_credentials, update_default_duration, get_all_users, delete_user, update_user_credentials, save_user_request, get_all_requests, approve_user_request
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before the modules below read their settings)
 load_dotenv()
 
+from db import init_db, close_db, save_user_credentials_async, get_user_credentials_async, update_default_duration_async, get_users_page_async, delete_user_async, update_user_credentials_async, save_user_request_async, get_requests_page_async, approve_user_request_async, approve_user_requests_async, reject_user_request_async, purge_requests_async, compact_db_async, import_users_async, export_users_async, get_user_engine_async, update_user_engine_async, save_user_schedule_async, get_user_schedule_async
+from notifier import notifier, send_notification, send_notifications
+import metrics
+from browser import BrowserPool, POOL_SIZE
+from supervisor import SessionSupervisor
+from multiplexer import close_multiplexer
+from fsm_storage import SQLiteStorage
+from job_queue import QueueLauncher, get_job_queue
+from scheduler import parse_schedule, format_schedule
+from user_import import parse_users, dump_users
+
 API_TOKEN = os.getenv('API_TOKEN')
 ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID'))
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # Alternative Bot API server, e.g. a local fake for testing
+
+# Webhook mode settings
+BOT_MODE = os.getenv('BOT_MODE', 'polling')  # "polling" or "webhook"
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Public base URL Telegram posts updates to
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+PAGE_SIZE = 10  # Rows per page of the admin listings
+MAINTENANCE_INTERVAL = int(os.getenv('DB_MAINTENANCE_INTERVAL', str(24 * 3600)))  # Seconds between request purges and compaction
+LAUNCH_BACKEND = os.getenv('LAUNCH_BACKEND', 'local')  # "local" runs sessions in this process, "queue" hands them to worker.py
+webhook_worker_index = 0
+
+bot_session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=API_TOKEN, session=bot_session)
+dp = Dispatcher(storage=SQLiteStorage())
 
 # Initialize the database
 init_db()
 
-# Store Selenium processes
-selenium_processes = {}
+# Hot spare browsers, used instead of a cold start per launch when BROWSER_POOL_SIZE > 0
+browser_pool = BrowserPool() if POOL_SIZE > 0 and LAUNCH_BACKEND == "local" else None
+
+# Attendance sessions run inside the bot process, or on worker processes pulling from the job queue
+if LAUNCH_BACKEND == "queue":
+    supervisor = QueueLauncher(get_job_queue())
+else:
+    supervisor = SessionSupervisor(browser_pool=browser_pool)
+
+# Time every update from arrival to the end of its handler
+@dp.update.outer_middleware()
+async def measure_updates(handler, event, data):
+    with metrics.span("update_handling"):
+        return await handler(event, data)
 
 # Create buttons
 buttons = [
     KeyboardButton(text="Запустить"),  # Button to start the default script
     KeyboardButton(text="Изменить продолжительность"),
+    KeyboardButton(text="Расписание"),
     KeyboardButton(text="Просмотр пользователей"),
     KeyboardButton(text="Удалить пользователя"),
     KeyboardButton(text="Обновить пользователя"),
@@ -46,6 +90,7 @@ class UserInputStates(StatesGroup):
     waiting_for_username = State()
     waiting_for_password = State()
     waiting_for_duration = State()
+    waiting_for_schedule = State()
     waiting_for_user_id_to_delete = State()
     waiting_for_user_id_to_update = State()
     waiting_for_new_username = State()
@@ -55,26 +100,13 @@ class UserInputStates(StatesGroup):
     waiting_for_add_username = State()
     waiting_for_add_password = State()
 
-# Function to send notifications via Telegram
-def send_notification(chat_id, message):
-    url = f"https://api.telegram.org/bot{API_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": chat_id,
-        "text": message
-    }
-    try:
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        print(f"Error sending notification: {e}")
-
 # Command /start
 @dp.message(Command(commands=["start"]))
 async def start_command(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     if user_id == ADMIN_USER_ID:
         await message.reply("Welcome, Admin! Use the buttons below to manage users.", reply_markup=main_keyboard)
-    elif get_user_credentials(user_id):
+    elif await get_user_credentials_async(user_id):
         await message.reply("Welcome back! Use the buttons below to manage your attendance.", reply_markup=main_keyboard)
     else:
         await message.reply("Welcome! Please send your username to request access.")
@@ -97,7 +129,7 @@ async def get_request_password(message: types.Message, state: FSMContext):
     username = user_data.get("username")
 
     # Save the user request to the database
-    save_user_request(user_id, username, password)
+    await save_user_request_async(user_id, username, password)
 
     # Notify the admin
     send_notification(ADMIN_USER_ID, f"New access request from user ID {user_id} with username {username}.")
@@ -118,21 +150,27 @@ async def handle_run_button(message: types.Message):
 # Function to launch the script
 async def launch_script(message: types.Message):
     user_id = message.from_user.id
-    if user_credentials := get_user_credentials(user_id):
+    if user_credentials := await get_user_credentials_async(user_id):
         username, password, default_duration = user_credentials
-        await message.reply(f"Запускаем авто отметку с продолжительностью {default_duration} минут. Ждите...", reply_markup=cancel_keyboard)
+        engine = await get_user_engine_async(user_id)
         try:
-            # Start the Selenium process
-            process = subprocess.Popen([
-                "python", "auto_attend.py", 
-                username, password, 
-                str(default_duration), 
-                str(message.from_user.id), 
-                os.getenv("API_TOKEN")
-            ])
-            selenium_processes[user_id] = process
+            # Start the attendance session
+            started = await supervisor.start(user_id, engine, username, password, default_duration, user_id, API_TOKEN)
         except Exception as e:
             await message.reply(f"Ошибка при запуске: {e}", reply_markup=main_keyboard)
+            return
+        if started is None:
+            await message.reply("Процесс отметки уже запущен. Нажмите «Отмена», чтобы остановить его.", reply_markup=cancel_keyboard)
+            return
+        status = await supervisor.status(user_id)
+        if status and status.get("position"):
+            await message.reply(
+                f"Сейчас нет свободных мест для запуска. Вы в очереди: {status['position']}-й. "
+                "Отметка начнется автоматически, как только место освободится.",
+                reply_markup=cancel_keyboard,
+            )
+            return
+        await message.reply(f"Запускаем авто отметку с продолжительностью {default_duration} минут. Ждите...", reply_markup=cancel_keyboard)
     else:
         await message.reply("Пожалуйста, сначала сохраните ваши учетные данные через /start.")
 
@@ -140,15 +178,50 @@ async def launch_script(message: types.Message):
 @dp.message(lambda message: message.text == "Отмена")
 async def handle_cancel_button(message: types.Message):
     user_id = message.from_user.id
-    if user_id in selenium_processes:
-        process = selenium_processes[user_id]
-        process.terminate()
-        process.wait()  # Wait for the process to terminate
-        del selenium_processes[user_id]
+    if await supervisor.cancel(user_id):
         await message.reply("Процесс отметки был успешно остановлен.", reply_markup=main_keyboard)
     else:
         await message.reply("Нет активного процесса для остановки.", reply_markup=main_keyboard)
 
+# Command /status to show the user's attendance session
+@dp.message(Command(commands=["status"]))
+async def session_status(message: types.Message):
+    status = await supervisor.status(message.from_user.id)
+    if status is None:
+        await message.reply("Нет активного процесса отметки.")
+    elif status["state"] == "queued" and status.get("position"):
+        await message.reply(f"Процесс отметки ожидает свободного места, вы в очереди {status['position']}-й.")
+    elif status["state"] == "queued":
+        await message.reply("Процесс отметки ожидает свободного места.")
+    else:
+        minutes_left = max(0, int((status["deadline"] - time.time()) // 60))
+        await message.reply(f"Процесс отметки запущен ({status['engine']}), осталось {minutes_left} минут.")
+
+# Command /stats with the bot's metrics, admin only
+@dp.message(Command(commands=["stats"]))
+async def show_stats(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.reply("You are not authorized to use this command.")
+        return
+    counters, gauges, spans = metrics.snapshot()
+    lines = ["Счетчики:"] + [f"{name}: {value}" for name, value in sorted(counters.items())]
+    lines += ["", "Текущие значения:"]
+    for name, value in sorted(gauges.items()):
+        lines.append(f"{name}: {value / (1024 * 1024):.1f} MB" if name.endswith("_bytes") else f"{name}: {value}")
+    lines += ["", "Время (количество, среднее):"] + [f"{name}: {count}, {average * 1000:.1f} ms" for name, (count, average) in sorted(spans.items())]
+    await message.reply("\n".join(lines))
+
+# Command /engine to choose between the browserless HTTP engine and Selenium
+@dp.message(Command(commands=["engine"]))
+async def set_engine(message: types.Message, command: CommandObject):
+    engine = (command.args or "").strip().lower()
+    if engine not in ("http", "selenium"):
+        current = await get_user_engine_async(message.from_user.id)
+        await message.reply(f"Текущий движок: {current}. Использование: /engine http|selenium")
+        return
+    await update_user_engine_async(message.from_user.id, engine)
+    await message.reply(f"Движок отметки изменен на {engine}.", reply_markup=main_keyboard)
+
 # Handle "Изменить продолжительность" button
 @dp.message(lambda message: message.text == "Изменить продолжительность")
 async def change_default_duration(message: types.Message, state: FSMContext):
@@ -161,26 +234,104 @@ async def set_new_duration(message: types.Message, state: FSMContext):
     try:
         user_id = message.from_user.id
         duration = int(message.text)
-        update_default_duration(user_id, duration)
+        await update_default_duration_async(user_id, duration)
         await message.reply(f"Продолжительность по умолчанию обновлена на {duration} минут.", reply_markup=main_keyboard)
         await state.clear()
     except ValueError:
         await message.reply("Пожалуйста, введите число.")
 
+# Handle "Расписание" button
+@dp.message(lambda message: message.text == "Расписание")
+async def change_schedule(message: types.Message, state: FSMContext):
+    lessons = await get_user_schedule_async(message.from_user.id)
+    current = format_schedule(lessons) if lessons else "не задано"
+    await message.reply(
+        f"Текущее расписание:\n{current}\n\n"
+        "Отправьте начало каждой пары отдельной строкой, например:\nПн 09:00\nСр 13:00\n"
+        "Отправьте «-», чтобы очистить расписание."
+    )
+    await state.set_state(UserInputStates.waiting_for_schedule)
+
+# Handle new schedule input
+@dp.message(UserInputStates.waiting_for_schedule)
+async def set_new_schedule(message: types.Message, state: FSMContext):
+    try:
+        lessons = [] if message.text.strip() == "-" else parse_schedule(message.text)
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+    await save_user_schedule_async(message.from_user.id, lessons)
+    if lessons:
+        await message.reply(f"Расписание сохранено:\n{format_schedule(lessons)}", reply_markup=main_keyboard)
+    else:
+        await message.reply("Расписание очищено.", reply_markup=main_keyboard)
+    await state.clear()
+
 # Handle "Просмотр пользователей" button
 @dp.message(lambda message: message.text == "Просмотр пользователей")
 async def view_users(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_USER_ID:
         await message.reply("You are not authorized to use this command.")
         return
-    users = get_all_users()
+    text, keyboard = await users_page()
+    await message.reply(text, reply_markup=keyboard)
+
+# "Назад"/"Вперед" buttons of a listing; callbacks carry the key to seek from
+def page_navigation(prefix, rows, has_prev, has_next):
+    navigation = []
+    if rows and has_prev:
+        navigation.append(InlineKeyboardButton(text="« Назад", callback_data=f"{prefix}_prev_{rows[0][0]}"))
+    if rows and has_next:
+        navigation.append(InlineKeyboardButton(text="Вперед »", callback_data=f"{prefix}_next_{rows[-1][0]}"))
+    return [navigation] if navigation else []
+
+# Text and keyboard of one page of the user list
+async def users_page(cursor=0, backwards=False):
+    users, has_prev, has_next = await get_users_page_async(cursor, backwards, PAGE_SIZE)
+    if not users and cursor:
+        users, has_prev, has_next = await get_users_page_async(0, False, PAGE_SIZE)
     if not users:
-        await message.reply("Нет пользователей в базе данных.")
+        return "Нет пользователей в базе данных.", None
+    text = "\n".join(f"ID: {user[0]}, Username: {user[1]}, Duration: {user[2]}, Engine: {user[3] or 'selenium'}" for user in users)
+    return text, InlineKeyboardMarkup(inline_keyboard=page_navigation("users", users, has_prev, has_next))
+
+# Text and keyboard of one page of pending requests, with approve/reject buttons per request
+async def requests_page(cursor=0, backwards=False):
+    requests, has_prev, has_next = await get_requests_page_async(cursor, backwards, PAGE_SIZE)
+    if not requests and cursor:
+        requests, has_prev, has_next = await get_requests_page_async(0, False, PAGE_SIZE)
+    if not requests:
+        return "Нет запросов в базе данных.", None
+    # Approve/reject re-render the page from its first request
+    start = requests[0][0] - 1
+    text = "\n".join(f"Request ID: {req[0]}, User ID: {req[1]}, Username: {req[2]}, Status: {req[3]}" for req in requests)
+    keyboard = [
+        [
+            InlineKeyboardButton(text=f"Approve {req[0]}", callback_data=f"approve_{req[0]}_{start}"),
+            InlineKeyboardButton(text=f"Reject {req[0]}", callback_data=f"reject_{req[0]}_{start}"),
+        ]
+        for req in requests
+    ]
+    keyboard.append([InlineKeyboardButton(text="Approve all pending", callback_data="approve_all")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard + page_navigation("requests", requests, has_prev, has_next))
+
+# Replace a listing message with another page
+async def show_page(callback_query, text, keyboard):
+    try:
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        pass  # The page did not change
+
+# Handle the page buttons of the user and request lists
+@dp.callback_query(lambda c: c.data and (c.data.startswith('users_') or c.data.startswith('requests_')))
+async def turn_page(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != ADMIN_USER_ID:
+        await callback_query.answer(text="You are not authorized to use this command.")
         return
-    for i in range(0, len(users), 10):
-        user_page = users[i:i + 10]
-        user_info = "\n".join([f"ID: {user[0]}, Username: {user[1]}, Duration: {user[3]}" for user in user_page])
-        await message.reply(user_info)
+    listing, direction, cursor = callback_query.data.split('_')
+    render = users_page if listing == "users" else requests_page
+    await show_page(callback_query, *await render(int(cursor), direction == "prev"))
+    await callback_query.answer()
 
 # Handle "Удалить пользователя" button
 @dp.message(lambda message: message.text == "Удалить пользователя")
@@ -199,7 +350,7 @@ async def delete_user_by_id(message: types.Message, state: FSMContext):
         return
     try:
         user_id = int(message.text)
-        delete_user(user_id)
+        await delete_user_async(user_id)
         await message.reply(f"Пользователь с ID {user_id} был удален.", reply_markup=main_keyboard)
         await state.clear()
     except ValueError:
@@ -251,7 +402,7 @@ async def get_new_password(message: types.Message, state: FSMContext):
     new_username = user_data.get("new_username")
 
     # Update user credentials in the database
-    update_user_credentials(user_id, new_username, new_password)
+    await update_user_credentials_async(user_id, new_username, new_password)
 
     await message.reply(f"Данные пользователя с ID {user_id} были обновлены.", reply_markup=main_keyboard)
     await state.clear()
@@ -281,50 +432,187 @@ async def get_add_password(message: types.Message, state: FSMContext):
     new_username = user_data.get("new_username")
 
     # Save new user credentials to the database
-    save_user_credentials(message.from_user.id, new_username, new_password)
+    await save_user_credentials_async(message.from_user.id, new_username, new_password)
 
     await message.reply(f"Пользователь {new_username} был добавлен.", reply_markup=main_keyboard)
     await state.clear()
 
+# Bulk import: the admin uploads a .csv or .json file with user_id, username, password[, default_duration, engine]
+@dp.message(lambda message: message.document is not None)
+async def import_users_file(message: types.Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.reply("You are not authorized to use this command.")
+        return
+    data = await bot.download(message.document)
+    try:
+        rows = parse_users(message.document.file_name or "", data.read())
+    except ValueError as e:
+        await message.reply(str(e))
+        return
+    count = await import_users_async(rows)
+    await message.reply(f"Импортировано пользователей: {count}.", reply_markup=main_keyboard)
+
+# Command /export [csv|json] sends every user as a file
+@dp.message(Command(commands=["export"]))
+async def export_users_file(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.reply("You are not authorized to use this command.")
+        return
+    fmt = "json" if (command.args or "").strip().lower() == "json" else "csv"
+    rows = await export_users_async()
+    if not rows:
+        await message.reply("Нет пользователей в базе данных.")
+        return
+    document = BufferedInputFile(dump_users(rows, fmt), filename=f"users.{fmt}")
+    await message.reply_document(document, caption=f"Пользователей: {len(rows)}")
+
+# Approve several requests in one transaction and welcome the users with one batched send
+async def approve_requests(request_ids=None):
+    approved = await approve_user_requests_async(request_ids)
+    send_notifications((user_id, f"Your request has been approved. Welcome, {username}!") for user_id, username in approved)
+    return approved
+
+# Command /approve all | /approve <request_id> ...
+@dp.message(Command(commands=["approve"]))
+async def approve_command(message: types.Message, command: CommandObject):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.reply("You are not authorized to use this command.")
+        return
+    args = (command.args or "").replace(",", " ").split()
+    if args == ["all"]:
+        request_ids = None
+    elif args and all(arg.isdigit() for arg in args):
+        request_ids = [int(arg) for arg in args]
+    else:
+        await message.reply("Использование: /approve all или /approve <ID запроса> ...")
+        return
+    approved = await approve_requests(request_ids)
+    await message.reply(f"Одобрено запросов: {len(approved)}.")
+
 # Handle "Просмотр запросов" button
 @dp.message(lambda message: message.text == "Просмотр запросов")
 async def view_requests(message: types.Message, state: FSMContext):
     if message.from_user.id != ADMIN_USER_ID:
         await message.reply("You are not authorized to use this command.")
         return
-    requests = get_all_requests()
-    if not requests:
-        await message.reply("Нет запросов в базе данных.")
-        return
-    for req in requests:
-        request_info = f"Request ID: {req[0]}, User ID: {req[1]}, Username: {req[2]}, Status: {req[4]}"
-        approve_button = InlineKeyboardButton(text="Approve", callback_data=f"approve_{req[0]}")
-        reject_button = InlineKeyboardButton(text="Reject", callback_data=f"reject_{req[0]}")
-        inline_kb = InlineKeyboardMarkup(inline_keyboard=[[approve_button, reject_button]])
-        await message.reply(request_info, reply_markup=inline_kb)
+    text, keyboard = await requests_page()
+    await message.reply(text, reply_markup=keyboard)
 
 # Handle inline button callbacks
+@dp.callback_query(lambda c: c.data == 'approve_all')
+async def approve_all_requests(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != ADMIN_USER_ID:
+        await callback_query.answer(text="You are not authorized to use this command.")
+        return
+    approved = await approve_requests()
+    await callback_query.answer(text=f"{len(approved)} requests have been approved.")
+    await show_page(callback_query, *await requests_page())
+
 @dp.callback_query(lambda c: c.data and c.data.startswith('approve_'))
 async def approve_request(callback_query: types.CallbackQuery):
-    request_id = int(callback_query.data.split('_')[1])
-    user_id, username = approve_user_request(request_id)
+    if callback_query.from_user.id != ADMIN_USER_ID:
+        await callback_query.answer(text="You are not authorized to use this command.")
+        return
+    parts = callback_query.data.split('_')
+    request_id = int(parts[1])
+    start = int(parts[2]) if len(parts) > 2 else 0  # Buttons sent before paging carry no page
+    user_id, username = await approve_user_request_async(request_id)
     if user_id:
         await callback_query.answer(text=f"Request ID {request_id} has been approved.")
-        await bot.send_message(callback_query.from_user.id, f"Request ID {request_id} has been approved.")
         await bot.send_message(user_id, f"Your request has been approved. Welcome, {username}!")
+        await show_page(callback_query, *await requests_page(start))
     else:
         await callback_query.answer(text=f"Request ID {request_id} could not be approved.")
 
 @dp.callback_query(lambda c: c.data and c.data.startswith('reject_'))
 async def reject_request(callback_query: types.CallbackQuery):
-    request_id = int(callback_query.data.split('_')[1])
-    # Implement the logic to reject the request if needed
-    await callback_query.answer(text=f"Request ID {request_id} has been rejected.")
-    await bot.send_message(callback_query.from_user.id, f"Request ID {request_id} has been rejected.")
+    if callback_query.from_user.id != ADMIN_USER_ID:
+        await callback_query.answer(text="You are not authorized to use this command.")
+        return
+    parts = callback_query.data.split('_')
+    request_id = int(parts[1])
+    start = int(parts[2]) if len(parts) > 2 else 0
+    user_id, _ = await reject_user_request_async(request_id)
+    if user_id:
+        await callback_query.answer(text=f"Request ID {request_id} has been rejected.")
+        send_notification(user_id, "Your request has been rejected.")
+        await show_page(callback_query, *await requests_page(start))
+    else:
+        await callback_query.answer(text=f"Request ID {request_id} could not be rejected.")
+
+# Periodically delete old decided requests and compact the database
+async def run_maintenance():
+    while True:
+        try:
+            purged = await purge_requests_async()
+            vacuumed = await compact_db_async()
+            print(f"Database maintenance: {purged} old requests deleted{', file compacted' if vacuumed else ''}.")
+        except Exception as e:
+            print(f"Error in database maintenance: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+# Start background services (both polling and webhook mode)
+@dp.startup()
+async def on_startup():
+    await notifier.start(processes=WEBHOOK_WORKERS if BOT_MODE == "webhook" else 1)
+    await supervisor.start_watcher()
+    if browser_pool is not None:
+        browser_pool.fill()
+    if metrics.METRICS_PORT and webhook_worker_index == 0:
+        metrics.serve()
+    if webhook_worker_index == 0:
+        asyncio.get_running_loop().create_task(run_maintenance())
+    if BOT_MODE == "webhook" and webhook_worker_index == 0:
+        await bot.set_webhook(f"{WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET)
+
+# Stop background services
+@dp.shutdown()
+async def on_shutdown():
+    supervisor.shutdown()
+    close_multiplexer()
+    await notifier.stop()
+    if browser_pool is not None:
+        browser_pool.close()
+    close_db()
+
+# Serve Telegram webhook updates in one worker process
+def serve_webhook(index):
+    global webhook_worker_index
+    webhook_worker_index = index
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1)
+
+# Run `WEBHOOK_WORKERS` webhook processes sharing one port.
+# With local sessions every process would have its own supervisor, admission limits and browsers,
+# so several processes are only allowed when sessions run in worker.py.
+def run_webhook():
+    # Without a secret anyone who finds the URL could post updates as the admin
+    if not WEBHOOK_SECRET:
+        print("BOT_MODE=webhook needs WEBHOOK_SECRET.")
+        sys.exit(1)
+    if WEBHOOK_WORKERS <= 1:
+        serve_webhook(0)
+        return
+    if LAUNCH_BACKEND != "queue":
+        print("WEBHOOK_WORKERS > 1 needs LAUNCH_BACKEND=queue.")
+        sys.exit(1)
+    close_db()  # Forked workers must open their own SQLite connections
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=serve_webhook, args=(index,)) for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
 
 # Main function to start the bot
 async def main():
+    await bot.delete_webhook()
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if BOT_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import queue
+import threading
+from urllib.parse import urlsplit
+import psutil
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service as ChromeService
+from selenium.common.exceptions import SessionNotCreatedException
+import startup
+
+# Configuration Constants
+PORTAL_URL = os.getenv("PORTAL_URL", "https://wsp.kbtu.kz/RegistrationOnline")
+SHOW_UI = os.getenv("SHOW_UI") == "1"  # Headless unless asked otherwise
+LEAN_BROWSER = os.getenv("LEAN_BROWSER", "1") == "1"  # Block non-essential downloads and background features
+MAX_BROWSER_RSS_MB = int(os.getenv("MAX_BROWSER_RSS_MB", "768"))  # Ceiling on a browser's unique memory (USS), 0 disables it
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "0"))  # Number of hot spares, 0 disables the pool
+POOL_MAX_USES = int(os.getenv("BROWSER_POOL_MAX_USES", "20"))  # Launches served before a browser is recycled
+CHROMEDRIVER_PATH = os.getenv("CHROMEDRIVER_PATH")  # Fixed chromedriver binary, skips resolution entirely
+DRIVER_CACHE_FILE = os.getenv("CHROMEDRIVER_CACHE_FILE", ".chromedriver.json")
+DRIVER_CACHE_TTL = int(os.getenv("CHROMEDRIVER_CACHE_TTL", str(7 * 24 * 3600)))  # Seconds before the version is looked up again
+
+# Assets the portal renders fine without: images, fonts, media and third-party analytics.
+# Scripts and stylesheets are left alone, Vaadin needs both to build the page.
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp3", "*.mp4", "*.webm",
+    "*google-analytics.com*", "*googletagmanager.com*", "*mc.yandex.ru*", "*doubleclick.net*",
+]
+LEAN_ARGUMENTS = [
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+]
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+def _read_driver_cache():
+    try:
+        with open(DRIVER_CACHE_FILE) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None, 0
+    path = cache.get("path")
+    if not path or not os.path.isfile(path):
+        return None, 0
+    return path, cache.get("resolved_at", 0)
+
+def _write_driver_cache(path):
+    try:
+        with open(DRIVER_CACHE_FILE, "w") as f:
+            json.dump({"path": path, "resolved_at": time.time()}, f)
+    except OSError as e:
+        print(f"Could not save chromedriver cache: {e}")
+
+# Look the driver up with webdriver-manager; it needs the network, so it is only imported here
+def _install_driver():
+    from webdriver_manager.chrome import ChromeDriverManager
+    return ChromeDriverManager().install()
+
+# Resolve the chromedriver binary: CHROMEDRIVER_PATH, then the cache file, then webdriver-manager.
+# A stale cache entry is still used when the lookup fails, so launches keep working offline.
+def get_driver_path(refresh=False):
+    global _driver_path
+    with _driver_path_lock:
+        if CHROMEDRIVER_PATH:
+            return CHROMEDRIVER_PATH
+        if _driver_path is not None and not refresh:
+            return _driver_path
+        with startup.phase("driver_path"):
+            cached, resolved_at = _read_driver_cache()
+            if cached and not refresh and time.time() - resolved_at < DRIVER_CACHE_TTL:
+                _driver_path = cached
+                return _driver_path
+            try:
+                _driver_path = _install_driver()
+                _write_driver_cache(_driver_path)
+            except Exception as e:
+                if not cached:
+                    raise
+                print(f"Could not look up chromedriver, using cached {cached}: {e}")
+                _driver_path = cached
+        return _driver_path
+
+# Function to start a new Chrome instance
+def create_driver():
+    options = webdriver.ChromeOptions()
+    if not SHOW_UI:
+        options.add_argument('--headless=new')
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    if LEAN_BROWSER:
+        for argument in LEAN_ARGUMENTS:
+            options.add_argument(argument)
+    try:
+        driver = webdriver.Chrome(service=ChromeService(get_driver_path()), options=options)
+    except SessionNotCreatedException:
+        # Chrome was updated past the cached driver's version
+        if CHROMEDRIVER_PATH:
+            raise
+        driver = webdriver.Chrome(service=ChromeService(get_driver_path(refresh=True)), options=options)
+    if LEAN_BROWSER:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+# Wipe cookies and site storage so the next user gets a clean profile
+def reset_driver(driver, url=PORTAL_URL):
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+    parts = urlsplit(url)
+    driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": f"{parts.scheme}://{parts.netloc}", "storageTypes": "all"})
+    driver.get(url)
+
+# Selenium cookie dict -> CDP Network.CookieParam
+def _cdp_cookie(cookie, url):
+    param = {"name": cookie["name"], "value": cookie["value"], "path": cookie.get("path", "/")}
+    if cookie.get("domain"):
+        param["domain"] = cookie["domain"]
+    else:
+        param["url"] = url
+    for key in ("secure", "httpOnly", "sameSite"):
+        if key in cookie:
+            param[key] = cookie[key]
+    if "expiry" in cookie:
+        param["expires"] = cookie["expiry"]
+    return param
+
+# Hand a browser over to another user's portal session: wipe the previous user's cookies and storage,
+# load the new cookies through CDP (no need to be on the site first) and open the page once
+def switch_session(driver, cookies, url=PORTAL_URL):
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    parts = urlsplit(url)
+    driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": f"{parts.scheme}://{parts.netloc}", "storageTypes": "all"})
+    if cookies:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": [_cdp_cookie(cookie, url) for cookie in cookies]})
+    driver.get(url)
+
+# Quit a driver, ignoring errors from browsers that already died
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Error closing browser: {e}")
+
+# PIDs of chromedriver and every Chrome process it started
+def browser_pids(driver):
+    try:
+        service = psutil.Process(driver.service.process.pid)
+        return [service.pid] + [child.pid for child in service.children(recursive=True)]
+    except (AttributeError, psutil.Error):
+        return []
+
+# Memory of chromedriver and all its Chrome processes, in MB. Unique set size is summed because
+# RSS counts the pages Chrome's processes share once per process and overstates a browser several times over.
+def browser_rss(driver):
+    total = 0
+    for pid in browser_pids(driver):
+        try:
+            total += psutil.Process(pid).memory_full_info().uss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+# Whether the browser has grown past MAX_BROWSER_RSS_MB and should be restarted
+def over_memory_cap(driver):
+    return MAX_BROWSER_RSS_MB > 0 and browser_rss(driver) > MAX_BROWSER_RSS_MB
+
+# Kill leftover chromedriver/Chrome processes, skipping PIDs that now belong to something else
+def reap_browsers(pids):
+    for pid in pids:
+        try:
+            process = psutil.Process(pid)
+            if "chrom" in process.name().lower():
+                process.kill()
+        except psutil.Error:
+            pass
+
+# Pool of pre-started, pre-navigated browsers
+class BrowserPool:
+    def __init__(self, size=POOL_SIZE, max_uses=POOL_MAX_USES, url=PORTAL_URL):
+        self.size = size
+        self.max_uses = max_uses
+        self.url = url
+        self._idle = queue.Queue()
+        self._uses = {}
+        self._starting = 0
+        self._closed = False
+        self._lock = threading.Lock()
+
+    # Start browsers in the background until there are `size` hot spares
+    def fill(self):
+        with self._lock:
+            if self._closed:
+                return
+            missing = self.size - self._idle.qsize() - self._starting
+            self._starting += max(missing, 0)
+        for _ in range(missing):
+            threading.Thread(target=self._spawn, daemon=True).start()
+
+    def _spawn(self):
+        driver = None
+        try:
+            driver = self._start_browser()
+        except Exception as e:
+            print(f"Error starting pooled browser: {e}")
+        finally:
+            with self._lock:
+                self._starting -= 1
+        if driver is None:
+            return
+        if self._closed:
+            quit_driver(driver)
+        else:
+            self._idle.put(driver)
+
+    def _start_browser(self):
+        driver = create_driver()
+        driver.get(self.url)
+        self._uses[driver.session_id] = 0
+        return driver
+
+    # Check out a clean browser, cold-starting one if no spare is ready
+    def acquire(self):
+        driver = None
+        while driver is None:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                driver = self._start_browser()
+                break
+            try:
+                driver.current_url  # Spares can die while idle
+            except Exception:
+                self._discard(driver)
+                driver = None
+        self.fill()
+        return driver
+
+    # Return a browser to the pool, or recycle it after `max_uses` launches
+    def release(self, driver):
+        uses = self._uses.get(driver.session_id, 0) + 1
+        self._uses[driver.session_id] = uses
+        if self._closed or uses >= self.max_uses or self._idle.qsize() >= self.size or over_memory_cap(driver):
+            self._discard(driver)
+            self.fill()
+            return
+        try:
+            reset_driver(driver, self.url)
+        except Exception as e:
+            print(f"Error resetting pooled browser: {e}")
+            self._discard(driver)
+            self.fill()
+            return
+        self._idle.put(driver)
+
+    def _discard(self, driver):
+        self._uses.pop(driver.session_id, None)
+        quit_driver(driver)
+
+    # Quit every idle browser and stop refilling
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                break
@@ -1,122 +1,688 @@
+import os
+import json
+import time
+import queue
+import asyncio
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+import metrics
 
-DB_NAME = "user_data.db"
+DB_NAME = os.getenv("DB_NAME", "user_data.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))  # Idle connections kept open
+CACHED_STATEMENTS = 256  # Prepared statements cached per connection
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))  # User rows kept in memory
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))  # Seconds a cached row is trusted; writes from other processes show up after this
+REQUESTS_RETENTION_DAYS = int(os.getenv("REQUESTS_RETENTION_DAYS", "90"))  # Decided requests older than this are deleted
+COMPACT_FREE_RATIO = 0.25  # VACUUM once this share of the file is free pages
+
+_pool = queue.LifoQueue()
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+# Bounded LRU cache of user rows keyed by user_id; missing users are cached as None.
+# Writes in this process invalidate entries at once; entries also expire after `ttl` seconds because
+# workers and forked webhook processes keep caches of their own that never hear about each other's writes.
+class UserCache:
+    def __init__(self, size, ttl=USER_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0  # Bumped on every invalidation so in-flight reads don't cache stale rows
+        self._rows = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns (found, row)
+    def get(self, user_id):
+        with self._lock:
+            if user_id in self._rows:
+                row, expires = self._rows[user_id]
+                if time.monotonic() < expires:
+                    self._rows.move_to_end(user_id)
+                    self.hits += 1
+                    return True, row
+                del self._rows[user_id]
+            self.misses += 1
+            return False, None
+
+    def put(self, user_id, row, generation):
+        with self._lock:
+            if generation != self.generation:
+                return
+            self._rows[user_id] = (row, time.monotonic() + self.ttl)
+            self._rows.move_to_end(user_id)
+            while len(self._rows) > self.size:
+                self._rows.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self.generation += 1
+            if user_id is None:
+                self._rows.clear()
+            else:
+                self._rows.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._rows), "capacity": self.size}
+
+_user_cache = UserCache(USER_CACHE_SIZE)
+
+# Hit/miss counters of the user cache
+def cache_stats():
+    return _user_cache.stats()
+
+def _cache_metrics():
+    stats = cache_stats()
+    return {"user_cache_hits": stats["hits"], "user_cache_misses": stats["misses"], "user_cache_size": stats["size"]}
+
+metrics.register_collector(_cache_metrics)
+
+# Open a connection in autocommit mode with WAL journaling
+def _connect():
+    conn = sqlite3.connect(DB_NAME, timeout=30, isolation_level=None, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+# Borrow a long-lived connection from the pool; the time it is held is recorded as a db_call span
+@contextmanager
+def _connection():
+    started = time.perf_counter()
+    try:
+        conn = _pool.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+    finally:
+        metrics.observe("db_call", time.perf_counter() - started)
+        if _pool.qsize() < DB_POOL_SIZE:
+            _pool.put(conn)
+        else:
+            conn.close()
+
+# Run several statements as one write transaction
+@contextmanager
+def transaction():
+    with _connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+# Close every pooled connection
+def close_db():
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
 
 # Initialize the database
 def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT NOT NULL,
-        password TEXT NOT NULL,
-        default_duration INTEGER DEFAULT 60
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS requests (
-        request_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER NOT NULL,
-        username TEXT NOT NULL,
-        password TEXT NOT NULL,
-        status TEXT DEFAULT 'pending'
-    )
-    """)
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            default_duration INTEGER DEFAULT 60
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS requests (
+            request_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            status TEXT DEFAULT 'pending'
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS lessons (
+            user_id INTEGER NOT NULL,
+            weekday INTEGER NOT NULL,
+            start_time TEXT NOT NULL,
+            PRIMARY KEY (user_id, weekday, start_time)
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS portal_sessions (
+            user_id INTEGER PRIMARY KEY,
+            cookies TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            duration INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            worker_id TEXT,
+            lease_expires REAL,
+            deadline REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_user ON jobs (user_id, status)")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS active_sessions (
+            user_id INTEGER PRIMARY KEY,
+            owner TEXT NOT NULL,
+            host TEXT NOT NULL,
+            engine TEXT NOT NULL,
+            browser_pids TEXT NOT NULL DEFAULT '[]',
+            started_at REAL NOT NULL,
+            deadline REAL NOT NULL,
+            heartbeat_at REAL NOT NULL,
+            cancel_requested INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            storage_key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}'
+        )
+        """)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migration in MIGRATIONS[version:]:
+            migration(conn)
+        conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+
+def _columns(conn, table):
+    return [column[1] for column in conn.execute(f"PRAGMA table_info({table})")]
+
+# Migration 1: per-user engine choice (databases from before migrations may already have it)
+def _add_user_engine(conn):
+    if "engine" not in _columns(conn, "users"):
+        conn.execute("ALTER TABLE users ADD COLUMN engine TEXT DEFAULT 'selenium'")
+
+# Migration 2: request timestamps, indexes, and at most one pending request per user.
+# Older duplicate pending requests are marked 'superseded' so the unique index can be built.
+def _requests_lifecycle(conn):
+    columns = _columns(conn, "requests")
+    if "created_at" not in columns:
+        conn.execute("ALTER TABLE requests ADD COLUMN created_at REAL")
+    if "decided_at" not in columns:
+        conn.execute("ALTER TABLE requests ADD COLUMN decided_at REAL")
+    now = time.time()
+    conn.execute("UPDATE requests SET created_at = ? WHERE created_at IS NULL", (now,))
+    conn.execute("UPDATE requests SET decided_at = ? WHERE decided_at IS NULL AND status != 'pending'", (now,))
+    conn.execute("""
+        UPDATE requests SET status = 'superseded', decided_at = ?
+        WHERE status = 'pending'
+          AND request_id < (SELECT MAX(r.request_id) FROM requests r WHERE r.user_id = requests.user_id AND r.status = 'pending')
+    """, (now,))
+    conn.execute("CREATE INDEX IF NOT EXISTS requests_status ON requests (status, request_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS requests_decided ON requests (decided_at) WHERE decided_at IS NOT NULL")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS requests_one_pending ON requests (user_id) WHERE status = 'pending'")
+
+# Applied in order; PRAGMA user_version records how many have run
+MIGRATIONS = [_add_user_engine, _requests_lifecycle]
 
 # Save user credentials
 def save_user_credentials(user_id, username, password, default_duration=60):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT OR REPLACE INTO users (user_id, username, password, default_duration) VALUES (?, ?, ?, ?)",
-        (user_id, username, password, default_duration)
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, username, password, default_duration) VALUES (?, ?, ?, ?)",
+            (user_id, username, password, default_duration)
+        )
+    _user_cache.invalidate(int(user_id))
+
+# Read the user's row (username, password, default_duration, engine) from disk into the cache
+def _load_user(user_id):
+    generation = _user_cache.generation
+    with _connection() as conn:
+        row = conn.execute("SELECT username, password, default_duration, engine FROM users WHERE user_id = ?", (user_id,)).fetchone()
+    _user_cache.put(user_id, row, generation)
+    return row
+
+# Get the user's row, served from the cache when possible
+def _get_user(user_id):
+    found, row = _user_cache.get(int(user_id))
+    return row if found else _load_user(int(user_id))
 
 # Get user credentials
 def get_user_credentials(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username, password, default_duration FROM users WHERE user_id = ?", (user_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result
+    row = _get_user(user_id)
+    return row[:3] if row else None
 
 # Update default duration
 def update_default_duration(user_id, duration):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET default_duration = ? WHERE user_id = ?",
-        (duration, user_id)
-    )
-    conn.commit()
-    conn.close()
-
-# Get all users
-def get_all_users():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users")
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE users SET default_duration = ? WHERE user_id = ?",
+            (duration, user_id)
+        )
+    _user_cache.invalidate(int(user_id))
+
+# Get the attendance engine chosen by the user
+def get_user_engine(user_id):
+    row = _get_user(user_id)
+    return row[3] if row and row[3] else "selenium"
+
+# Update the attendance engine
+def update_user_engine(user_id, engine):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE users SET engine = ? WHERE user_id = ?",
+            (engine, user_id)
+        )
+    _user_cache.invalidate(int(user_id))
+
+# Replace the user's timetable with (weekday, "HH:MM") pairs
+def save_user_schedule(user_id, lessons):
+    with transaction() as conn:
+        conn.execute("DELETE FROM lessons WHERE user_id = ?", (user_id,))
+        conn.executemany(
+            "INSERT INTO lessons (user_id, weekday, start_time) VALUES (?, ?, ?)",
+            [(user_id, weekday, start_time) for weekday, start_time in lessons]
+        )
+
+# Get the user's timetable
+def get_user_schedule(user_id):
+    with _connection() as conn:
+        return conn.execute("SELECT weekday, start_time FROM lessons WHERE user_id = ? ORDER BY weekday, start_time", (user_id,)).fetchall()
+
+# Save the user's authenticated portal cookies
+def save_portal_session(user_id, cookies):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO portal_sessions (user_id, cookies, updated_at) VALUES (?, ?, ?)",
+            (user_id, json.dumps(cookies), time.time())
+        )
+
+# Get the user's saved portal cookies
+def get_portal_session(user_id):
+    with _connection() as conn:
+        result = conn.execute("SELECT cookies FROM portal_sessions WHERE user_id = ?", (user_id,)).fetchone()
+    return json.loads(result[0]) if result else None
+
+# One page of rows ordered by the integer key `key`: the rows after `cursor`, or before it when `backwards`.
+# Seeks on the key instead of using OFFSET, so a page costs the same wherever it is in the table.
+# Returns (rows, has_prev, has_next); one extra row is fetched to tell whether more follow.
+def _page(table, columns, key, cursor, backwards, limit, condition=None):
+    clauses = [condition] if condition else []
+    if backwards:
+        clauses.append(f"{key} < ?")
+    else:
+        clauses.append(f"{key} > ?")
+    sql = f"SELECT {columns} FROM {table} WHERE {' AND '.join(clauses)} ORDER BY {key} {'DESC' if backwards else 'ASC'} LIMIT ?"
+    with _connection() as conn:
+        rows = conn.execute(sql, (cursor, limit + 1)).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+            return rows, more, True
+        # A cursor above zero does not mean rows precede it: pages are redrawn from the first row after a decision
+        earlier = " AND ".join(([condition] if condition else []) + [f"{key} <= ?"])
+        has_prev = conn.execute(f"SELECT EXISTS (SELECT 1 FROM {table} WHERE {earlier})", (cursor,)).fetchone()[0] == 1
+    return rows, has_prev, more
+
+# Insert or update many users in one transaction; rows are (user_id, username, password, default_duration, engine).
+# A None duration or engine keeps an existing user's value and gives new users the defaults.
+# Saved portal sessions of the imported users are dropped, as with update_user_credentials.
+def import_users(rows):
+    with transaction() as conn:
+        conn.executemany(
+            """
+            INSERT INTO users (user_id, username, password, default_duration, engine)
+            VALUES (?1, ?2, ?3, COALESCE(?4, 60), COALESCE(?5, 'selenium'))
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username, password = excluded.password,
+                default_duration = COALESCE(?4, users.default_duration), engine = COALESCE(?5, users.engine)
+            """,
+            rows
+        )
+        conn.executemany("DELETE FROM portal_sessions WHERE user_id = ?", [(row[0],) for row in rows])
+    for row in rows:
+        _user_cache.invalidate(int(row[0]))
+    return len(rows)
+
+# Every user as (user_id, username, password, default_duration, engine), for /export
+def export_users():
+    with _connection() as conn:
+        return conn.execute("SELECT user_id, username, password, default_duration, engine FROM users ORDER BY user_id").fetchall()
+
+# A page of users as (user_id, username, default_duration, engine), passwords left out
+def get_users_page(cursor=0, backwards=False, limit=10):
+    return _page("users", "user_id, username, default_duration, engine", "user_id", cursor, backwards, limit)
 
 # Delete a user
 def delete_user(user_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM portal_sessions WHERE user_id = ?", (user_id,))
+    _user_cache.invalidate(int(user_id))
 
 # Update user credentials
 def update_user_credentials(user_id, username, password):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE users SET username = ?, password = ? WHERE user_id = ?",
-        (username, password, user_id)
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE users SET username = ?, password = ? WHERE user_id = ?",
+            (username, password, user_id)
+        )
+        conn.execute("DELETE FROM portal_sessions WHERE user_id = ?", (user_id,))
+    _user_cache.invalidate(int(user_id))
 
 # Save user request
+# A user has at most one pending request; asking again replaces its credentials
 def save_user_request(user_id, username, password):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO requests (user_id, username, password) VALUES (?, ?, ?)",
-        (user_id, username, password)
-    )
-    conn.commit()
-    conn.close()
-
-# Get all requests
-def get_all_requests():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM requests WHERE status = 'pending'")
-    result = cursor.fetchall()
-    conn.close()
-    return result
+    with transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO requests (user_id, username, password, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT (user_id) WHERE status = 'pending' DO UPDATE SET
+                username = excluded.username, password = excluded.password, created_at = excluded.created_at
+            """,
+            (user_id, username, password, time.time())
+        )
+
+# A page of pending requests as (request_id, user_id, username, status)
+def get_requests_page(cursor=0, backwards=False, limit=10):
+    return _page("requests", "request_id, user_id, username, status", "request_id", cursor, backwards, limit, "status = 'pending'")
 
 # Approve user request
 def approve_user_request(request_id):
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("SELECT user_id, username, password FROM requests WHERE request_id = ?", (request_id,))
-    request = cursor.fetchone()
-    if request:
+    with transaction() as conn:
+        request = conn.execute(
+            "SELECT user_id, username, password FROM requests WHERE request_id = ? AND status = 'pending'", (request_id,)
+        ).fetchone()
+        if not request:
+            return None, None
         user_id, username, password = request
-        save_user_credentials(user_id, username, password)
-        cursor.execute("UPDATE requests SET status = 'approved' WHERE request_id = ?", (request_id,))
-        conn.commit()
-        conn.close()
-        return user_id, username
-    conn.close()
-    return None, None
+        conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, username, password, default_duration) VALUES (?, ?, ?, ?)",
+            (user_id, username, password, 60)
+        )
+        conn.execute("UPDATE requests SET status = 'approved', decided_at = ? WHERE request_id = ?", (time.time(), request_id))
+    _user_cache.invalidate(user_id)
+    return user_id, username
+
+# Reject a pending request; returns (user_id, username), or (None, None) if it was not pending
+def reject_user_request(request_id):
+    with transaction() as conn:
+        request = conn.execute(
+            "SELECT user_id, username FROM requests WHERE request_id = ? AND status = 'pending'", (request_id,)
+        ).fetchone()
+        if not request:
+            return None, None
+        conn.execute("UPDATE requests SET status = 'rejected', decided_at = ? WHERE request_id = ?", (time.time(), request_id))
+    return request
+
+# Approve the given pending requests, or every pending one when `request_ids` is None, in one transaction.
+# Returns [(user_id, username)] of the approved users.
+def approve_user_requests(request_ids=None):
+    with transaction() as conn:
+        if request_ids is None:
+            requests = conn.execute(
+                "SELECT request_id, user_id, username, password FROM requests WHERE status = 'pending' ORDER BY request_id"
+            ).fetchall()
+        else:
+            placeholders = ", ".join("?" * len(request_ids))
+            requests = conn.execute(
+                f"SELECT request_id, user_id, username, password FROM requests WHERE status = 'pending' AND request_id IN ({placeholders}) ORDER BY request_id",
+                list(request_ids)
+            ).fetchall()
+        if not requests:
+            return []
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (user_id, username, password, default_duration) VALUES (?, ?, ?, 60)",
+            [(user_id, username, password) for _, user_id, username, password in requests]
+        )
+        now = time.time()
+        conn.executemany("UPDATE requests SET status = 'approved', decided_at = ? WHERE request_id = ?", [(now, request[0]) for request in requests])
+    approved = {}
+    for _, user_id, username, _ in requests:
+        _user_cache.invalidate(user_id)
+        approved[user_id] = username  # A user with several requests is welcomed once, under the latest name
+    return list(approved.items())
+
+# Delete requests decided more than `retention_days` ago; pending ones are kept however old
+def purge_requests(retention_days=REQUESTS_RETENTION_DAYS):
+    with transaction() as conn:
+        return conn.execute(
+            "DELETE FROM requests WHERE decided_at IS NOT NULL AND decided_at < ?", (time.time() - retention_days * 86400,)
+        ).rowcount
+
+# Refresh planner statistics, truncate the WAL, and VACUUM when enough of the file is free pages
+def compact_db():
+    with _connection() as conn:
+        conn.execute("PRAGMA optimize")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages = conn.execute("PRAGMA page_count").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if pages and free / pages >= COMPACT_FREE_RATIO:
+            conn.execute("VACUUM")
+            return True
+    return False
+
+# Stop the user's queued and running jobs
+def _cancel_user_jobs(conn, user_id):
+    cancelled = conn.execute("UPDATE jobs SET status = 'cancelled' WHERE user_id = ? AND status = 'queued'", (user_id,)).rowcount
+    cancelled += conn.execute(
+        "UPDATE jobs SET cancel_requested = 1 WHERE user_id = ? AND status = 'running' AND cancel_requested = 0", (user_id,)
+    ).rowcount
+    return cancelled > 0
+
+# Queue an attendance job; returns None if the user already has an active one
+def enqueue_job(user_id, duration):
+    with transaction() as conn:
+        active = conn.execute(
+            "SELECT 1 FROM jobs WHERE user_id = ? AND status IN ('queued', 'running') AND cancel_requested = 0", (user_id,)
+        ).fetchone()
+        if active:
+            return None
+        return conn.execute(
+            "INSERT INTO jobs (user_id, duration, created_at) VALUES (?, ?, ?)",
+            (user_id, duration, time.time())
+        ).lastrowid
+
+# Lease the oldest runnable job: queued, or running under a lease that expired
+def claim_job(worker_id, lease_seconds):
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("UPDATE jobs SET status = 'done' WHERE status IN ('queued', 'running') AND deadline <= ?", (now,))
+        conn.execute("UPDATE jobs SET status = 'cancelled' WHERE status = 'running' AND cancel_requested = 1 AND lease_expires < ?", (now,))
+        job = conn.execute(
+            "SELECT job_id, user_id, duration, deadline FROM jobs "
+            "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) ORDER BY job_id LIMIT 1",
+            (now,)
+        ).fetchone()
+        if job is None:
+            return None
+        job_id, user_id, duration, deadline = job
+        # A re-queued job only runs for what is left of its original window
+        deadline = deadline or now + duration * 60
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker_id = ?, lease_expires = ?, deadline = ?, attempts = attempts + 1 WHERE job_id = ?",
+            (worker_id, now + lease_seconds, deadline, job_id)
+        )
+        return job_id, user_id, deadline
+
+# Extend a lease; returns False once the worker lost the lease or the job was cancelled
+def heartbeat_job(job_id, worker_id, lease_seconds):
+    with transaction() as conn:
+        renewed = conn.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker_id = ? AND status = 'running' AND cancel_requested = 0",
+            (time.time() + lease_seconds, job_id, worker_id)
+        ).rowcount
+    return renewed == 1
+
+# Record how a job ended
+def finish_job(job_id, worker_id, status):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = CASE WHEN cancel_requested = 1 THEN 'cancelled' ELSE ? END, lease_expires = NULL "
+            "WHERE job_id = ? AND worker_id = ? AND status = 'running'",
+            (status, job_id, worker_id)
+        )
+
+# Cancel the user's active job
+def cancel_user_jobs(user_id):
+    with transaction() as conn:
+        return _cancel_user_jobs(conn, user_id)
+
+# Get the user's active job (job_id, status, deadline, created_at)
+def get_user_job(user_id):
+    with _connection() as conn:
+        return conn.execute(
+            "SELECT job_id, status, deadline, created_at FROM jobs WHERE user_id = ? AND status IN ('queued', 'running') "
+            "AND cancel_requested = 0 ORDER BY job_id DESC LIMIT 1",
+            (user_id,)
+        ).fetchone()
+
+# Record a new session and return its started_at, which identifies it in the calls below.
+# A session the same owner has already cancelled is replaced; otherwise returns None if the user already has one.
+def register_session(user_id, owner, host, engine, deadline):
+    now = time.time()
+    with transaction() as conn:
+        previous = conn.execute("SELECT started_at FROM active_sessions WHERE user_id = ?", (user_id,)).fetchone()
+        if previous and previous[0] >= now:
+            now = previous[0] + 0.001  # Coarse clocks could give a replacement the started_at of the session it replaces
+        registered = conn.execute(
+            "INSERT INTO active_sessions (user_id, owner, host, engine, started_at, deadline, heartbeat_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET host = excluded.host, engine = excluded.engine, browser_pids = '[]', "
+            "started_at = excluded.started_at, deadline = excluded.deadline, heartbeat_at = excluded.heartbeat_at, cancel_requested = 0 "
+            "WHERE active_sessions.owner = excluded.owner AND active_sessions.cancel_requested = 1",
+            (user_id, owner, host, engine, now, deadline, now)
+        ).rowcount == 1
+    return now if registered else None
+
+# Remember which browser processes belong to the session so they can be reaped after a crash
+def update_session_browsers(user_id, owner, started_at, pids):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE active_sessions SET browser_pids = ? WHERE user_id = ? AND owner = ? AND started_at = ?",
+            (json.dumps(pids), user_id, owner, started_at)
+        )
+
+# Remove the session, unless it has already been replaced by a newer one
+def unregister_session(user_id, owner, started_at):
+    with transaction() as conn:
+        conn.execute("DELETE FROM active_sessions WHERE user_id = ? AND owner = ? AND started_at = ?", (user_id, owner, started_at))
+
+# Refresh the owner's sessions and return the user_ids whose cancellation was requested
+def heartbeat_sessions(owner):
+    with transaction() as conn:
+        conn.execute("UPDATE active_sessions SET heartbeat_at = ? WHERE owner = ?", (time.time(), owner))
+        return [row[0] for row in conn.execute("SELECT user_id FROM active_sessions WHERE owner = ? AND cancel_requested = 1", (owner,))]
+
+# Ask whichever process owns the user's session to stop it
+def request_session_cancel(user_id):
+    with transaction() as conn:
+        return conn.execute("UPDATE active_sessions SET cancel_requested = 1 WHERE user_id = ?", (user_id,)).rowcount == 1
+
+# Get the user's session (owner, engine, started_at, deadline, cancel_requested)
+def get_active_session(user_id):
+    with _connection() as conn:
+        return conn.execute(
+            "SELECT owner, engine, started_at, deadline, cancel_requested FROM active_sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+
+# Distinct (owner, host) pairs in the session registry
+def get_session_owners():
+    with _connection() as conn:
+        return conn.execute("SELECT DISTINCT owner, host FROM active_sessions").fetchall()
+
+# Remove sessions whose owner stopped heartbeating or is known to be dead,
+# returning them as (user_id, host, engine, browser_pids, deadline, cancel_requested)
+def take_stale_sessions(stale_before, dead_owners=()):
+    dead_owners = list(dead_owners)
+    condition = f"heartbeat_at < ? OR owner IN ({', '.join('?' * len(dead_owners))})"
+    with transaction() as conn:
+        rows = conn.execute(
+            f"SELECT user_id, host, engine, browser_pids, deadline, cancel_requested FROM active_sessions WHERE {condition}",
+            [stale_before] + dead_owners
+        ).fetchall()
+        conn.execute(f"DELETE FROM active_sessions WHERE {condition}", [stale_before] + dead_owners)
+    return [(user_id, host, engine, json.loads(pids), deadline, cancel_requested) for user_id, host, engine, pids, deadline, cancel_requested in rows]
+
+# FSM state and data for one storage key
+def get_fsm_record(storage_key):
+    with _connection() as conn:
+        row = conn.execute("SELECT state, data FROM fsm_storage WHERE storage_key = ?", (storage_key,)).fetchone()
+    return (row[0], json.loads(row[1])) if row else (None, {})
+
+def set_fsm_state(storage_key, state):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO fsm_storage (storage_key, state) VALUES (?, ?) ON CONFLICT(storage_key) DO UPDATE SET state = excluded.state",
+            (storage_key, state)
+        )
+        conn.execute("DELETE FROM fsm_storage WHERE storage_key = ? AND state IS NULL AND data = '{}'", (storage_key,))
+
+def set_fsm_data(storage_key, data):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO fsm_storage (storage_key, data) VALUES (?, ?) ON CONFLICT(storage_key) DO UPDATE SET data = excluded.data",
+            (storage_key, json.dumps(data))
+        )
+        conn.execute("DELETE FROM fsm_storage WHERE storage_key = ? AND state IS NULL AND data = '{}'", (storage_key,))
+
+# Awaitable variant of a DB call, run on the DB thread pool so handlers never block the event loop
+def _awaitable(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(_executor, partial(func, *args, **kwargs))
+    return wrapper
+
+# Cache hits are answered on the event loop; only misses go to the DB thread pool
+async def _get_user_async(user_id):
+    found, row = _user_cache.get(int(user_id))
+    if found:
+        return row
+    return await asyncio.get_running_loop().run_in_executor(_executor, _load_user, int(user_id))
+
+async def get_user_credentials_async(user_id):
+    row = await _get_user_async(user_id)
+    return row[:3] if row else None
+
+async def get_user_engine_async(user_id):
+    row = await _get_user_async(user_id)
+    return row[3] if row and row[3] else "selenium"
+
+save_user_credentials_async = _awaitable(save_user_credentials)
+update_default_duration_async = _awaitable(update_default_duration)
+update_user_engine_async = _awaitable(update_user_engine)
+save_user_schedule_async = _awaitable(save_user_schedule)
+get_user_schedule_async = _awaitable(get_user_schedule)
+get_users_page_async = _awaitable(get_users_page)
+delete_user_async = _awaitable(delete_user)
+update_user_credentials_async = _awaitable(update_user_credentials)
+save_user_request_async = _awaitable(save_user_request)
+get_requests_page_async = _awaitable(get_requests_page)
+approve_user_request_async = _awaitable(approve_user_request)
+approve_user_requests_async = _awaitable(approve_user_requests)
+reject_user_request_async = _awaitable(reject_user_request)
+purge_requests_async = _awaitable(purge_requests)
+compact_db_async = _awaitable(compact_db)
+import_users_async = _awaitable(import_users)
+export_users_async = _awaitable(export_users)
+enqueue_job_async = _awaitable(enqueue_job)
+cancel_user_jobs_async = _awaitable(cancel_user_jobs)
+get_user_job_async = _awaitable(get_user_job)
+register_session_async = _awaitable(register_session)
+unregister_session_async = _awaitable(unregister_session)
+heartbeat_sessions_async = _awaitable(heartbeat_sessions)
+request_session_cancel_async = _awaitable(request_session_cancel)
+get_active_session_async = _awaitable(get_active_session)
+get_session_owners_async = _awaitable(get_session_owners)
+take_stale_sessions_async = _awaitable(take_stale_sessions)
+get_fsm_record_async = _awaitable(get_fsm_record)
+set_fsm_state_async = _awaitable(set_fsm_state)
+set_fsm_data_async = _awaitable(set_fsm_data)
@@ -0,0 +1,26 @@
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+from db import get_fsm_record_async, set_fsm_state_async, set_fsm_data_async
+
+# FSM storage kept in the SQLite database so conversations survive a bot restart
+class SQLiteStorage(BaseStorage):
+    @staticmethod
+    def _key(key):
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id}:{key.business_connection_id}:{key.destiny}"
+
+    async def set_state(self, key, state=None):
+        await set_fsm_state_async(self._key(key), state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        state, _ = await get_fsm_record_async(self._key(key))
+        return state
+
+    async def set_data(self, key, data):
+        await set_fsm_data_async(self._key(key), dict(data))
+
+    async def get_data(self, key):
+        _, data = await get_fsm_record_async(self._key(key))
+        return data
+
+    async def close(self):
+        pass
@@ -0,0 +1,316 @@
+import os
+import re
+import json
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import startup
+import metrics
+from portal_health import portal_health, next_delay
+from db import get_portal_session, save_portal_session
+from notifier import send_notification
+from scheduler import PollScheduler
+
+# Configuration Constants
+PORTAL_URL = os.getenv("PORTAL_URL", "https://wsp.kbtu.kz/RegistrationOnline")
+WAIT_TIME = 20
+UPDATE_INTERVAL = 60
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "100"))
+MAX_SESSION_FAILURES = 10  # Consecutive failed checks that end a session while the portal is fine for others
+
+ATTEND_CAPTION = "Отметиться"
+NO_COURSES_TEXT = "Нет доступных дисциплин"
+
+# Vaadin server RPC interfaces used by the login form and the attendance buttons
+BUTTON_RPC = "com.vaadin.shared.ui.button.ButtonServerRpc"
+CHECKBOX_RPC = "com.vaadin.shared.ui.checkbox.CheckBoxServerRpc"
+TEXT_FIELD_RPC = "com.vaadin.shared.ui.textfield.AbstractTextFieldServerRpc"
+MOUSE_DETAILS = {
+    "button": "LEFT", "clientX": 0, "clientY": 0, "relativeX": 0, "relativeY": 0, "type": 1,
+    "altKey": False, "ctrlKey": False, "metaKey": False, "shiftKey": False,
+}
+
+# Connection pool shared by every user's session; cookies stay per session
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+
+class VaadinError(Exception):
+    pass
+
+class SessionExpired(VaadinError):
+    pass
+
+# Create a cookie-isolated session on top of the shared connection pool
+def new_session():
+    session = requests.Session()
+    session.mount("https://", _adapter)
+    session.mount("http://", _adapter)
+    return session
+
+# Minimal Vaadin client: bootstraps a UI, mirrors connector state and sends server RPC calls
+class VaadinClient:
+    def __init__(self, session, url=PORTAL_URL):
+        self.session = session
+        self.url = url
+        self.version = 8
+        self._reset()
+
+    def _reset(self):
+        self.ui_id = None
+        self.csrf_token = None
+        self.sync_id = -1
+        self.client_id = 0
+        self.states = {}
+        self.types = {}
+        self.type_names = {}
+        self.hierarchy = {}
+
+    # Load the page and initialise a fresh UI, the equivalent of a browser refresh
+    def bootstrap(self):
+        response = self.session.get(self.url, timeout=WAIT_TIME)
+        response.raise_for_status()
+        app_id = re.search(r'initApplication\("([^"]+)"', response.text)
+        if app_id is None:
+            raise VaadinError("Vaadin bootstrap script not found")
+        version = re.search(r'"vaadinVersion"\s*:\s*"(\d+)', response.text)
+        if version is not None:
+            self.version = int(version.group(1))
+
+        now = int(time.time() * 1000)
+        details = {
+            "v-browserDetails": "1", "v-appId": app_id.group(1), "v-loc": self.url,
+            "v-sh": "1080", "v-sw": "1920", "v-cw": "1920", "v-ch": "1080", "v-vw": "1920", "v-vh": "1080",
+            "v-curdate": str(now), "v-tzo": "-300", "v-rtzo": "-300", "v-dstd": "0", "v-dston": "false",
+            "v-wn": f"{app_id.group(1)}-{now}",
+        }
+        response = self.session.post(f"{self.url}?v-{now}", data=details, timeout=WAIT_TIME)
+        response.raise_for_status()
+        payload = self._decode(response.text)
+        if "v-uiId" not in payload:
+            raise SessionExpired("Portal did not return a UI")
+        self._reset()
+        self.ui_id = payload["v-uiId"]
+        self._apply(json.loads(payload["uidl"]))
+
+    # Send a batch of RPC invocations and merge the server's response into local state
+    def rpc(self, calls):
+        body = {"csrfToken": self.csrf_token, "rpc": calls, "syncId": self.sync_id, "clientId": self.client_id}
+        response = self.session.post(
+            f"{self.url.rstrip('/')}/UIDL/?v-uiId={self.ui_id}",
+            data=json.dumps(body),
+            headers={"Content-Type": "application/json; charset=UTF-8"},
+            timeout=WAIT_TIME,
+        )
+        response.raise_for_status()
+        self.client_id += 1
+        messages = self._decode(response.text)
+        for message in messages if isinstance(messages, list) else [messages]:
+            self._apply(message)
+
+    # Empty UIDL round-trip to pick up server-side changes
+    def sync(self):
+        self.rpc([])
+
+    def _decode(self, text):
+        if text.startswith("for(;;);"):
+            text = text[len("for(;;);"):]
+        return json.loads(text)
+
+    def _apply(self, message):
+        meta = message.get("meta", {})
+        if meta.get("sessionExpired") or "appError" in meta:
+            raise SessionExpired("Portal session expired")
+        if "Vaadin-Security-Key" in message:
+            self.csrf_token = message["Vaadin-Security-Key"]
+        if "syncId" in message:
+            self.sync_id = message["syncId"]
+        self.type_names.update({str(index): name for name, index in message.get("typeMappings", {}).items()})
+        self.types.update(message.get("types", {}))
+        self.hierarchy.update(message.get("hierarchy", {}))
+        for connector_id, state in message.get("state", {}).items():
+            self.states.setdefault(connector_id, {}).update(state)
+
+    # Connector ids currently attached to the UI
+    def visible(self):
+        seen = []
+        pending = ["0"]
+        while pending:
+            connector_id = pending.pop()
+            if connector_id in seen:
+                continue
+            seen.append(connector_id)
+            pending.extend(self.hierarchy.get(connector_id, []))
+        return seen
+
+    def type_of(self, connector_id):
+        return self.type_names.get(str(self.types.get(connector_id)), "")
+
+    def find(self, type_name):
+        return [c for c in self.visible() if self.type_of(c).endswith("." + type_name)]
+
+    def buttons(self, caption):
+        return [c for c in self.find("Button") if self.states.get(c, {}).get("caption") == caption]
+
+    def has_text(self, text):
+        for connector_id in self.visible():
+            state = self.states.get(connector_id, {})
+            if text in str(state.get("text", "")) or text in str(state.get("caption", "")):
+                return True
+        return False
+
+    def logged_out(self):
+        return bool(self.find("PasswordField"))
+
+    def set_text(self, connector_id, value):
+        if self.version >= 8:
+            return [connector_id, TEXT_FIELD_RPC, "setText", [value, len(value)]]
+        return [connector_id, "v", "v", ["text", ["s", value]]]
+
+    def check(self, connector_id):
+        return [connector_id, CHECKBOX_RPC, "setChecked", [True, MOUSE_DETAILS]]
+
+    def click(self, connector_id):
+        return [connector_id, BUTTON_RPC, "click", [MOUSE_DETAILS]]
+
+    # Cookies in the same shape Selenium's get_cookies() uses, so both engines share saved sessions
+    def get_cookies(self):
+        return [
+            {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path, "secure": c.secure, **({"expiry": c.expires} if c.expires else {})}
+            for c in self.session.cookies
+        ]
+
+    def add_cookies(self, cookies):
+        for cookie in cookies:
+            self.session.cookies.set(cookie["name"], cookie["value"], domain=cookie.get("domain", ""), path=cookie.get("path", "/"))
+
+    # Session.close() would close the shared adapter and drop every other user's keep-alive connections
+    def close(self):
+        self.session.cookies.clear()
+        self.session = None
+
+# Function to login to the website
+def login(client, username, password):
+    text_fields = client.find("TextField")
+    password_fields = client.find("PasswordField")
+    checkboxes = client.find("CheckBox")
+    submit_buttons = [c for c in client.find("Button") if "primary" in client.states.get(c, {}).get("styles", [])]
+    if not (text_fields and password_fields and submit_buttons):
+        raise VaadinError("Login form not found")
+
+    calls = [client.set_text(text_fields[0], username), client.set_text(password_fields[0], password)]
+    if checkboxes:
+        calls.append(client.check(checkboxes[0]))
+    calls.append(client.click(submit_buttons[0]))
+    client.rpc(calls)
+    if client.logged_out():
+        raise VaadinError("Login was rejected")
+
+# Log in and store the authenticated cookies for the next run
+def relogin(client, username, password, user_id):
+    with metrics.span("portal_login"):
+        login(client, username, password)
+    save_portal_session(user_id, client.get_cookies())
+
+# Function to attempt attendance; portal errors are raised to the caller.
+# A page without an "Отметиться" button is normal (attendance not open yet, or already marked).
+def try_to_attend(client, chat_id):
+    deadline = time.time() + WAIT_TIME
+    detection_started = time.perf_counter()
+    while True:
+        if client.has_text(NO_COURSES_TEXT):
+            print("No available courses found.")
+            return
+        button_ids = client.buttons(ATTEND_CAPTION)
+        if button_ids:
+            metrics.observe("button_detection", time.perf_counter() - detection_started)
+            break
+        if time.time() >= deadline:
+            metrics.inc("attendance_timeouts")
+            print("Timeout reached, could not mark attendance.")
+            return
+        time.sleep(1)
+        client.sync()
+
+    # Click on each button to attempt attendance
+    for button_id in button_ids:
+        with metrics.span("button_click"):
+            client.rpc([client.click(button_id)])
+        metrics.inc("attendance_marks")
+        send_notification(chat_id, "Attendance successful!")
+
+# Main function to control the HTTP engine
+# Startup errors are raised so the caller can fall back to Selenium
+def main(username, password, duration, chat_id, bot_token, stop_event=None):
+    client = VaadinClient(new_session())
+    try:
+        # Reuse the saved session when it is still valid
+        client.add_cookies(get_portal_session(chat_id) or [])
+        with startup.phase("page_load"):
+            client.bootstrap()
+        with startup.phase("login"):
+            if client.logged_out():
+                relogin(client, username, password, chat_id)
+    except Exception:
+        client.close()
+        raise
+
+    try:
+        # Set the end time based on the duration
+        end_time = time.time() + duration * 60
+
+        # Poll densely around the user's lessons, every `UPDATE_INTERVAL` seconds without a timetable
+        poller = PollScheduler.for_user(chat_id, UPDATE_INTERVAL)
+
+        failures = 0  # Consecutive failed checks of this session
+        refresh = False
+
+        # Main loop to attempt attendance
+        while time.time() < end_time:
+            # While the portal is failing for everyone, wait out the shared backoff instead of polling
+            pause = min(portal_health.wait_time(), max(0, end_time - time.time()))
+            if pause > 0:
+                if stop_event is None:
+                    time.sleep(pause)
+                elif stop_event.wait(pause):
+                    break
+                continue
+            try:
+                if refresh:
+                    with metrics.span("page_refresh"):
+                        client.bootstrap()
+                    if client.logged_out():
+                        relogin(client, username, password, chat_id)
+                refresh = True
+                try:
+                    try_to_attend(client, chat_id)
+                except SessionExpired:
+                    # Start a new UI and log in again right away
+                    client.bootstrap()
+                    relogin(client, username, password, chat_id)
+                    continue
+                problem = None
+            except (requests.RequestException, VaadinError) as e:
+                problem = str(e)
+
+            if problem is None:
+                failures = 0
+                portal_health.record_success(chat_id)
+            else:
+                failures += 1
+                portal_health.record_failure(chat_id, problem)
+                if failures >= MAX_SESSION_FAILURES and not portal_health.is_open():
+                    raise RuntimeError(problem)  # The portal works for others, so this session is broken
+            startup.mark("first_poll")
+            startup.emit()
+            delay = min(next_delay(poller.next_delay(), failures), max(0, end_time - time.time()))
+            if stop_event is None:
+                time.sleep(delay)
+            elif stop_event.wait(delay):
+                break
+
+    except Exception as e:
+        send_notification(chat_id, f"An error occurred in the main loop: {e}")
+        print(f"Error in main loop: {e}")
+    finally:
+        client.close()
+        portal_health.finish(chat_id)
+        send_notification(chat_id, "Script execution finished.")
@@ -0,0 +1,76 @@
+import os
+import time
+import importlib
+from db import (
+    enqueue_job, claim_job, heartbeat_job, finish_job, cancel_user_jobs, get_user_job,
+    enqueue_job_async, cancel_user_jobs_async, get_user_job_async, get_user_engine_async,
+)
+
+# Configuration Constants
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "sqlite")  # "sqlite" or "module:Class" of another backend
+LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Job queue stored in the bot's SQLite database.
+# Other backends implement the same methods, with async twins for use from the bot.
+class SQLiteJobQueue:
+    def enqueue(self, user_id, duration):
+        return enqueue_job(user_id, duration)
+
+    # Returns (job_id, user_id, deadline) or None
+    def claim(self, worker_id, lease_seconds=LEASE_SECONDS):
+        return claim_job(worker_id, lease_seconds)
+
+    def heartbeat(self, job_id, worker_id, lease_seconds=LEASE_SECONDS):
+        return heartbeat_job(job_id, worker_id, lease_seconds)
+
+    def finish(self, job_id, worker_id, status):
+        finish_job(job_id, worker_id, status)
+
+    def cancel(self, user_id):
+        return cancel_user_jobs(user_id)
+
+    # Returns (job_id, status, deadline, created_at) or None
+    def get(self, user_id):
+        return get_user_job(user_id)
+
+    async def enqueue_async(self, user_id, duration):
+        return await enqueue_job_async(user_id, duration)
+
+    async def cancel_async(self, user_id):
+        return await cancel_user_jobs_async(user_id)
+
+    async def get_async(self, user_id):
+        return await get_user_job_async(user_id)
+
+# Build the configured queue backend
+def get_job_queue():
+    if JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobQueue()
+    module_name, class_name = JOB_QUEUE_BACKEND.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+# Drop-in replacement for SessionSupervisor that hands sessions to worker processes
+class QueueLauncher:
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+
+    # Workers own their sessions, so there is nothing to recover here
+    async def start_watcher(self):
+        pass
+
+    async def start(self, user_id, engine, username, password, duration, chat_id, bot_token):
+        return await self.job_queue.enqueue_async(user_id, duration)
+
+    async def cancel(self, user_id):
+        return await self.job_queue.cancel_async(user_id)
+
+    async def status(self, user_id):
+        job = await self.job_queue.get_async(user_id)
+        if job is None:
+            return None
+        job_id, state, deadline, created_at = job
+        engine = await get_user_engine_async(user_id)
+        return {"state": state, "engine": engine, "created_at": created_at, "started_at": None, "deadline": deadline or time.time()}
+
+    def shutdown(self):
+        pass
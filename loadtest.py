@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import tempfile
+import itertools
+from mock_portal import MockPortal, start_in_thread
+
+# Load test of the bot's update handling: feeds synthetic Telegram updates straight into bot.py's Dispatcher
+# from many simulated users at once and reports handler latency per flow and how long the event loop was blocked.
+# Bot API calls are answered in-process by FakeSession; notifications go to mock_portal.py's fake sendMessage.
+
+# Configuration Constants
+LOADTEST_PORT = int(os.getenv("LOADTEST_PORT", "8082"))
+ADMIN_ID = 1
+USER_ID_BASE = 100000  # Seeded users get IDs from here on
+SIGNUP_ID_BASE = 10000000  # Users that sign up during the run
+LAG_INTERVAL = 0.005  # Seconds between event loop lag samples
+BLOCK_THRESHOLD = 0.01  # Lag above this counts as the loop being blocked
+
+USAGE = "Usage: python loadtest.py [--users=50] [--signups=5] [--admins=1] [--seed-users=1000] [--duration=30] [--think-time=0.5] [--api-latency=0] [--output=loadtest_results.json] [--compare=previous.json]"
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summary(values):
+    return {
+        "p50_ms": _ms(percentile(values, 0.5)),
+        "p99_ms": _ms(percentile(values, 0.99)),
+        "max_ms": _ms(percentile(values, 1.0)),
+        "count": len(values),
+    }
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+# Answers the bot's Bot API calls without a network, after an optional simulated round trip.
+# Requests are still serialised the way a real session would, so keyboard encoding stays in the measurement.
+def fake_session(api_latency):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Message
+
+    class FakeSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self._message_ids = itertools.count(1)
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            files = {}
+            for value in method.model_dump(warnings=False).values():
+                self.prepare_value(value, bot=bot, files=files)
+            if api_latency:
+                await asyncio.sleep(api_latency)
+            if method.__api_method__ in ("sendMessage", "sendDocument", "editMessageText"):
+                chat_id = getattr(method, "chat_id", None) or ADMIN_ID
+                return Message.model_validate(
+                    _message(next(self._message_ids), chat_id, getattr(method, "text", None), bot.id), context={"bot": bot}
+                )
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+def _message(message_id, user_id, text, sender=None):
+    message = {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": sender or user_id, "is_bot": sender is not None, "first_name": "Load"},
+        "text": text,
+    }
+    if text and text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return message
+
+# Feeds one simulated user's updates and times each of them
+class LoadClient:
+    _update_ids = itertools.count(1)
+
+    def __init__(self, bot_module, user_id, latencies):
+        self.bot = bot_module.bot
+        self.dp = bot_module.dp
+        self.user_id = user_id
+        self.latencies = latencies  # step name -> [seconds]
+
+    async def _feed(self, step, update):
+        from aiogram.types import Update
+        update = Update.model_validate(update, context={"bot": self.bot})
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def send(self, step, text):
+        update_id = next(self._update_ids)
+        await self._feed(step, {"update_id": update_id, "message": _message(update_id, self.user_id, text)})
+
+    async def press(self, step, data):
+        update_id = next(self._update_ids)
+        await self._feed(step, {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": {"id": self.user_id, "is_bot": False, "first_name": "Load"},
+                "chat_instance": "load",
+                "data": data,
+                "message": _message(update_id, self.user_id, "listing", self.bot.id),
+            },
+        })
+
+# A registered student: opens the bot, starts a session, checks it and cancels it
+async def student_flow(client, options):
+    await client.send("start_known", "/start")
+    await client.send("run", "Запустить")
+    await client.send("status", "/status")
+    await client.send("cancel", "Отмена")
+    if random.random() < 0.2:
+        await client.send("duration_prompt", "Изменить продолжительность")
+        await client.send("duration_set", str(random.choice((45, 60, 90))))
+
+# A new user going through the access request
+async def signup_flow(client, options):
+    client.user_id = next(options["signup_ids"])
+    await client.send("start_new", "/start")
+    await client.send("request_username", f"load{client.user_id}")
+    await client.send("request_password", "secret")
+
+# The admin paging through users and requests and approving what came in
+async def admin_flow(client, options):
+    await client.send("admin_users", "Просмотр пользователей")
+    cursor = USER_ID_BASE + random.randrange(max(options["seed-users"], 1))
+    await client.press("admin_users_page", f"users_next_{cursor}")
+    await client.send("admin_requests", "Просмотр запросов")
+    await client.send("admin_approve_all", "/approve all")
+    await client.send("admin_stats", "/stats")
+
+async def run_client(client, flow, options, deadline):
+    while time.time() < deadline:
+        try:
+            await flow(client, options)
+        except Exception as e:
+            options["errors"].append(f"{flow.__name__}: {e}")
+        await asyncio.sleep(random.uniform(0, 2 * options["think-time"]))
+
+# Measures how late the event loop wakes up; late wake-ups mean something ran on the loop without yielding
+async def watch_loop(lags, stop):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(max(0.0, loop.time() - started - LAG_INTERVAL))
+
+async def run_load(bot_module, options):
+    from db import import_users
+    from notifier import notifier
+
+    session = fake_session(options["api-latency"])
+    bot_module.bot.session = session
+    import_users([(USER_ID_BASE + index, f"user{index}", "secret", 60, "http") for index in range(options["seed-users"])])
+    await notifier.start()
+
+    latencies = {}
+    options["signup_ids"] = itertools.count(SIGNUP_ID_BASE)
+    options["errors"] = []
+    clients = [(LoadClient(bot_module, USER_ID_BASE + index % max(options["seed-users"], 1), latencies), student_flow) for index in range(options["users"])]
+    clients += [(LoadClient(bot_module, 0, latencies), signup_flow) for _ in range(options["signups"])]
+    clients += [(LoadClient(bot_module, ADMIN_ID, latencies), admin_flow) for _ in range(options["admins"])]
+
+    lags = []
+    stop = asyncio.Event()
+    watcher = asyncio.create_task(watch_loop(lags, stop))
+    started = time.time()
+    await asyncio.gather(*(run_client(client, flow, options, started + options["duration"]) for client, flow in clients))
+    wall = time.time() - started
+    stop.set()
+    await watcher
+    await notifier.stop(timeout=1)
+
+    updates = sum(len(values) for values in latencies.values())
+    blocked = [lag for lag in lags if lag > BLOCK_THRESHOLD]
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "users": options["users"],
+        "signups": options["signups"],
+        "admins": options["admins"],
+        "seed_users": options["seed-users"],
+        "api_latency": options["api-latency"],
+        "wall_seconds": round(wall, 2),
+        "updates": updates,
+        "updates_per_second": round(updates / wall, 1),
+        "api_calls": session.calls,
+        "errors": len(options["errors"]),
+        "handler_latency": summary([value for values in latencies.values() for value in values]),
+        "steps": {step: summary(values) for step, values in sorted(latencies.items())},
+        "event_loop": {
+            "lag": summary(lags),
+            "blocked_seconds": round(sum(blocked), 3),
+            "blocked_share": round(sum(blocked) / wall, 4),
+            "stalls": len(blocked),
+        },
+    }
+
+# Print how the headline numbers moved since a previous run
+def compare(previous, current):
+    for name, then, now in (
+        ("handler p50 ms", previous["handler_latency"]["p50_ms"], current["handler_latency"]["p50_ms"]),
+        ("handler p99 ms", previous["handler_latency"]["p99_ms"], current["handler_latency"]["p99_ms"]),
+        ("updates/s", previous["updates_per_second"], current["updates_per_second"]),
+        ("loop blocked s", previous["event_loop"]["blocked_seconds"], current["event_loop"]["blocked_seconds"]),
+    ):
+        if now is not None and then is not None:
+            print(f"  {name}: {then} -> {now} ({now - then:+.3f})")
+    for step, values in current["steps"].items():
+        before = previous["steps"].get(step)
+        if before and values["p99_ms"] is not None and before["p99_ms"] is not None:
+            print(f"  {step} p99 ms: {before['p99_ms']} -> {values['p99_ms']} ({values['p99_ms'] - before['p99_ms']:+.3f})")
+
+def main():
+    options = {
+        "users": "50", "signups": "5", "admins": "1", "seed-users": "1000", "duration": "30", "think-time": "0.5",
+        "api-latency": "0", "output": "loadtest_results.json", "compare": None,
+    }
+    for arg in sys.argv[1:]:
+        name, _, value = arg.lstrip("-").partition("=")
+        if name not in options or not value:
+            print(USAGE)
+            return 1
+        options[name] = value
+    for name in ("users", "signups", "admins", "seed-users"):
+        options[name] = int(options[name])
+    for name in ("duration", "think-time", "api-latency"):
+        options[name] = float(options[name])
+
+    portal = MockPortal()
+    base_url = start_in_thread(portal, port=LOADTEST_PORT)
+    # bot.py reads these at import time; sessions are only queued, so no browser is started
+    os.environ["API_TOKEN"] = "123456:loadtest"
+    os.environ["ADMIN_USER_ID"] = str(ADMIN_ID)
+    os.environ["TELEGRAM_API_URL"] = base_url
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "loadtest.db")
+    os.environ["LAUNCH_BACKEND"] = "queue"
+    os.environ["METRICS_PORT"] = "0"
+    import bot as bot_module
+    from db import close_db
+
+    print(f"Feeding updates from {options['users']} students, {options['signups']} new users and {options['admins']} admins for {options['duration']:.0f}s...")
+    results = asyncio.run(run_load(bot_module, options))
+    close_db()
+    print(json.dumps(results, indent=2))
+    for error in options["errors"][:10]:
+        print(f"Error: {error}")
+
+    with open(options["output"], "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved to {options['output']}")
+    if options["compare"]:
+        with open(options["compare"]) as f:
+            compare(json.load(f), results)
+    return 0
+
+# Entry point of the script
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+# In-process counters, gauges and timing spans, rendered in the Prometheus text format.
+# Each process (bot, worker, auto_attend) keeps its own numbers.
+
+# Configuration Constants
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port of the /metrics endpoint, 0 disables it
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+PREFIX = "autoattend_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}  # name -> value
+_gauges = {}  # name -> value
+_spans = {}  # name -> [bucket counts..., count, sum]
+_collectors = []  # Callables returning {name: value} gauges computed at scrape time
+
+def inc(name, value=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+def set_gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+def add_gauge(name, value):
+    with _lock:
+        _gauges[name] = _gauges.get(name, 0) + value
+
+def observe(name, seconds):
+    with _lock:
+        span = _spans.setdefault(name, [0] * (len(BUCKETS) + 2))
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                span[index] += 1
+        span[-2] += 1
+        span[-1] += seconds
+
+# Time a block of code, also when it raises
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started)
+
+def register_collector(collector):
+    _collectors.append(collector)
+
+def _collected():
+    values = {}
+    for collector in _collectors:
+        try:
+            values.update(collector())
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+    return values
+
+# Memory of this process and of the browsers it started
+def _process_memory():
+    import psutil
+    process = psutil.Process()
+    children = 0
+    for child in process.children(recursive=True):
+        try:
+            children += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return {"process_resident_memory_bytes": process.memory_info().rss, "browser_resident_memory_bytes": children}
+
+register_collector(_process_memory)
+
+# Counters, gauges and span averages as plain values, for the /stats command
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        spans = {name: (values[-2], values[-1] / values[-2] if values[-2] else 0) for name, values in _spans.items()}
+    gauges.update(_collected())
+    return counters, gauges, spans
+
+# Everything in the Prometheus text exposition format
+def render():
+    counters, gauges, _ = snapshot()
+    with _lock:
+        spans = {name: list(values) for name, values in _spans.items()}
+    lines = []
+    for name, value in sorted(counters.items()):
+        lines += [f"# TYPE {PREFIX}{name}_total counter", f"{PREFIX}{name}_total {value}"]
+    for name, value in sorted(gauges.items()):
+        lines += [f"# TYPE {PREFIX}{name} gauge", f"{PREFIX}{name} {value}"]
+    for name, values in sorted(spans.items()):
+        metric = f"{PREFIX}{name}_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        for bound, count in zip(BUCKETS, values):
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+        lines += [f'{metric}_bucket{{le="+Inf"}} {values[-2]}', f"{metric}_count {values[-2]}", f"{metric}_sum {values[-1]:.6f}"]
+    return "\n".join(lines) + "\n"
+
+# Serve /metrics on a background thread (http.server is imported here to keep attendance startup light)
+def serve(port=METRICS_PORT, host=METRICS_HOST):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Metrics on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,267 @@
+import sys
+import json
+import time
+import uuid
+import asyncio
+import threading
+from aiohttp import web
+
+# Local stand-in for the RegistrationOnline portal and the Telegram Bot API, used by benchmark.py.
+# The page renders the same DOM the Selenium engine looks for and answers the Vaadin UIDL calls of the
+# HTTP engine. "Отметиться" buttons appear `button_delay` seconds after login.
+
+# Configuration Constants
+PORTAL_PATH = "/RegistrationOnline"
+PUSH_INTERVAL = 500  # How often the page asks the server for changes, in ms
+ATTEND_CAPTION = "Отметиться"
+NO_COURSES_TEXT = "Нет доступных дисциплин"
+
+TYPE_MAPPINGS = {
+    "com.vaadin.ui.UI": 0, "com.vaadin.ui.TextField": 1, "com.vaadin.ui.PasswordField": 2,
+    "com.vaadin.ui.CheckBox": 3, "com.vaadin.ui.Button": 4, "com.vaadin.ui.Label": 5,
+}
+LOGIN_FORM = {"1": 1, "2": 2, "3": 3, "4": 4}  # Connector id -> type
+FIRST_BUTTON_ID = 10
+
+PAGE = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>RegistrationOnline</title></head>
+<body><div id="app"></div>
+<script>
+var vaadinConfig = {"vaadinVersion": "8.14.3"};
+function initApplication(id) {}
+initApplication("registrationonline-1");
+
+const app = document.getElementById('app');
+const LOGIN_FORM = `
+<div class="v-formlayout">
+  <input type="text" class="v-textfield">
+  <input type="password" class="v-textfield">
+  <span class="v-checkbox"><input type="checkbox" id="remember"><label for="remember">Запомнить</label></span>
+  <div role="button" class="v-button v-button-primary" id="submit"><span class="v-button-wrap"><span class="v-button-caption">Войти</span></span></div>
+</div>`;
+let rendered = null;
+
+async function post(path, body) {
+  await fetch(path, {method: 'POST', credentials: 'same-origin', body: JSON.stringify(body)});
+  await refresh();
+}
+
+function render(state) {
+  if (!state.logged_in) {
+    app.innerHTML = LOGIN_FORM;
+    document.getElementById('submit').onclick = () => post('/mock/login', {
+      username: app.querySelector('input[type="text"]').value,
+      password: app.querySelector('input[type="password"]').value,
+    });
+  } else if (state.buttons.length) {
+    app.innerHTML = state.buttons.map(id =>
+      `<div role="button" class="v-button" data-id="${id}"><span class="v-button-wrap"><span class="v-button-caption">%(caption)s</span></span></div>`
+    ).join('');
+    for (const button of app.querySelectorAll('.v-button')) {
+      button.onclick = () => post('/mock/click', {id: button.dataset.id});
+    }
+  } else {
+    app.innerHTML = '<div class="v-label">%(no_courses)s</div>';
+  }
+}
+
+// Stands in for Vaadin's server push: re-render only when the server state changed
+async function refresh() {
+  const response = await fetch('/mock/state', {credentials: 'same-origin'});
+  const state = await response.json();
+  const key = JSON.stringify(state);
+  if (key !== rendered) {
+    rendered = key;
+    render(state);
+  }
+}
+refresh();
+setInterval(refresh, %(interval)d);
+</script></body></html>
+""" % {"caption": ATTEND_CAPTION, "no_courses": NO_COURSES_TEXT, "interval": PUSH_INTERVAL}
+
+# One portal login session, identified by its JSESSIONID cookie
+class PortalSession:
+    def __init__(self):
+        self.username = None
+        self.buttons_due = None
+        self.buttons = []
+        self.next_button = FIRST_BUTTON_ID
+        self.texts = {}
+        self.sync_id = 0
+        self.csrf_token = uuid.uuid4().hex
+
+# Portal state plus everything the benchmark measures: when buttons appeared, were clicked, and notifications
+class MockPortal:
+    def __init__(self, button_delay=5, buttons=1):
+        self.button_delay = button_delay
+        self.button_count = buttons
+        self.reset()
+
+    def reset(self):
+        self.sessions = {}
+        self.marks = {}  # username -> {"appeared": ts, "clicked": [ts, ...]}
+        self.messages = []  # (chat_id, text, received_at)
+        self.logins = 0
+        self.requests = 0
+
+    def _session(self, request):
+        session_id = request.cookies.get("JSESSIONID")
+        if session_id not in self.sessions:
+            session_id = uuid.uuid4().hex
+            self.sessions[session_id] = PortalSession()
+        return session_id, self.sessions[session_id]
+
+    def _respond(self, response, session_id):
+        response.set_cookie("JSESSIONID", session_id, path="/")
+        return response
+
+    def _login(self, session, username, password):
+        if not username or not password:
+            return
+        self.logins += 1
+        session.username = username
+        session.buttons_due = time.time() + self.button_delay
+
+    # Buttons become visible once their time has come; clicked ones disappear
+    def _buttons(self, session):
+        if session.username is None:
+            return []
+        if session.buttons_due is not None and time.time() >= session.buttons_due:
+            for _ in range(self.button_count):
+                session.buttons.append(str(session.next_button))
+                session.next_button += 1
+            self.marks.setdefault(session.username, {"appeared": session.buttons_due, "clicked": []})
+            session.buttons_due = None
+        return session.buttons
+
+    def _click(self, session, button_id):
+        if button_id in session.buttons:
+            session.buttons.remove(button_id)
+            self.marks[session.username]["clicked"].append(time.time())
+
+    # Browser endpoints
+
+    async def page(self, request):
+        self.requests += 1
+        session_id, _ = self._session(request)
+        return self._respond(web.Response(text=PAGE, content_type="text/html"), session_id)
+
+    async def state(self, request):
+        self.requests += 1
+        session_id, session = self._session(request)
+        state = {"logged_in": session.username is not None, "buttons": list(self._buttons(session))}
+        return self._respond(web.json_response(state), session_id)
+
+    async def login(self, request):
+        session_id, session = self._session(request)
+        body = json.loads(await request.text())
+        self._login(session, body.get("username"), body.get("password"))
+        return self._respond(web.json_response({}), session_id)
+
+    async def click(self, request):
+        session_id, session = self._session(request)
+        self._click(session, json.loads(await request.text()).get("id"))
+        return self._respond(web.json_response({}), session_id)
+
+    # Vaadin endpoints used by http_engine
+
+    def _uidl(self, session):
+        session.sync_id += 1
+        if session.username is None:
+            types = dict(LOGIN_FORM)
+            children = list(LOGIN_FORM)
+            state = {"4": {"caption": "Войти", "styles": ["primary"]}}
+        else:
+            buttons = self._buttons(session)
+            children = list(buttons) or ["5"]
+            types = {connector_id: 4 for connector_id in buttons}
+            types["5"] = 5
+            state = {connector_id: {"caption": ATTEND_CAPTION} for connector_id in buttons}
+            state["5"] = {"text": NO_COURSES_TEXT}
+        types["0"] = 0
+        return {
+            "syncId": session.sync_id,
+            "Vaadin-Security-Key": session.csrf_token,
+            "typeMappings": TYPE_MAPPINGS,
+            "types": types,
+            "hierarchy": {"0": children},
+            "state": state,
+        }
+
+    async def bootstrap(self, request):
+        self.requests += 1
+        session_id, session = self._session(request)
+        payload = {"v-uiId": 0, "uidl": json.dumps(self._uidl(session))}
+        return self._respond(web.Response(text=json.dumps(payload), content_type="application/json"), session_id)
+
+    async def rpc(self, request):
+        self.requests += 1
+        if request.cookies.get("JSESSIONID") not in self.sessions:
+            # Like Vaadin, a UIDL call without a live session only gets a session-expired notice
+            return web.Response(text='for(;;);[{"meta":{"sessionExpired":true}}]', content_type="application/json")
+        session_id, session = self._session(request)
+        body = json.loads(await request.text())
+        for connector_id, _, method, args in body.get("rpc", []):
+            if method == "setText":
+                session.texts[connector_id] = args[0]
+            elif method == "v":  # Vaadin 7 variable change
+                session.texts[connector_id] = args[1][1]
+            elif method == "click" and connector_id == "4":
+                self._login(session, session.texts.get("1"), session.texts.get("2"))
+            elif method == "click":
+                self._click(session, connector_id)
+        text = "for(;;);" + json.dumps([self._uidl(session)])
+        return self._respond(web.Response(text=text, content_type="application/json"), session_id)
+
+    # Fake Telegram Bot API: records sendMessage calls and answers the rest with a generic success
+
+    async def telegram(self, request):
+        method = request.match_info["method"]
+        body = await request.json() if request.can_read_body and request.content_type == "application/json" else dict(await request.post())
+        if method == "sendMessage":
+            received_at = time.time()
+            self.messages.append((str(body.get("chat_id")), body.get("text"), received_at))
+            result = {
+                "message_id": len(self.messages), "date": int(received_at), "text": body.get("text"),
+                "chat": {"id": int(body.get("chat_id", 0)), "type": "private"},
+            }
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Mock", "username": "mock_bot"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(PORTAL_PATH, self.page)
+        app.router.add_post(PORTAL_PATH, self.bootstrap)
+        app.router.add_post(PORTAL_PATH + "/UIDL/", self.rpc)
+        app.router.add_get("/mock/state", self.state)
+        app.router.add_post("/mock/login", self.login)
+        app.router.add_post("/mock/click", self.click)
+        app.router.add_post("/bot{token}/{method}", self.telegram)
+        return app
+
+# Serve the mock on a background thread; returns the base URL
+def start_in_thread(portal, host="127.0.0.1", port=8081):
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(portal.app(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    return f"http://{host}:{port}"
+
+# Entry point of the script
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    print(f"Mock portal on http://127.0.0.1:{port}{PORTAL_PATH}, Bot API on http://127.0.0.1:{port}")
+    web.run_app(MockPortal().app(), host="127.0.0.1", port=port, access_log=None)
@@ -0,0 +1,217 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import metrics
+from db import get_portal_session
+from notifier import send_notification
+from portal_health import portal_health, next_delay
+from scheduler import PollScheduler
+from browser import create_driver, quit_driver, switch_session, over_memory_cap, browser_pids
+from auto_attend import UPDATE_INTERVAL, watch_page, report_clicks, relogin
+
+# Configuration Constants
+MUX_BROWSERS = int(os.getenv("MUX_BROWSERS", "0"))  # Browsers shared by all Selenium sessions, 0 gives each session its own
+MUX_MAX_STALENESS = int(os.getenv("MUX_MAX_STALENESS", "60"))  # Longest a user goes unchecked, in seconds
+MUX_CHECK_TIMEOUT = 10  # Seconds one check waits for the page to settle
+MUX_MAX_ERRORS = 3  # Consecutive browser errors before a session is given up while the portal is healthy
+MUX_CLOSE_TIMEOUT = 30  # Seconds close() waits for checks in progress before quitting their browsers
+
+# One user's multiplexed session
+class MuxSession:
+    def __init__(self, username, password, duration, chat_id, stop_event):
+        self.username = username
+        self.password = password
+        self.chat_id = chat_id
+        self.end_time = time.time() + duration * 60
+        self.stop_event = stop_event
+        self.poller = PollScheduler.for_user(chat_id, UPDATE_INTERVAL)
+        self.last_checked = None
+        self.errors = 0
+        self.done = threading.Event()
+
+    # Next check is due at the user's poll interval, but never later than the staleness limit
+    def next_due(self, now):
+        return min(now + next_delay(self.poller.next_delay(now)), now + MUX_MAX_STALENESS, self.end_time)
+
+# A few browsers take turns checking many users: each check loads the user's cookies into a free browser,
+# clicks any "Отметиться" button and moves on. Checks are served earliest-due first, so under load every
+# user is delayed by about the same amount instead of some starving.
+class Multiplexer:
+    def __init__(self, browsers=MUX_BROWSERS):
+        self.browsers = browsers
+        self._due = []  # Heap of (due time, sequence, session)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._threads = []
+        self._lock = threading.Lock()  # Guards _drivers and _listeners, which the serve threads and close() share
+        self._drivers = {}
+        self._listeners = {}  # session -> on_browser callback
+
+    def start(self):
+        for index in range(self.browsers):
+            thread = threading.Thread(target=self._serve, args=(index,), daemon=True, name=f"mux-{index}")
+            thread.start()
+            self._threads.append(thread)
+
+    # Run one user's session on the shared browsers; blocks like auto_attend.main until it ends.
+    # on_browser gets the PIDs of all the shared browsers now and whenever one starts or quits,
+    # so the session registry can reap them if this process dies.
+    def run(self, username, password, duration, chat_id, stop_event, on_browser=None):
+        session = MuxSession(username, password, duration, chat_id, stop_event)
+        if on_browser is not None:
+            with self._lock:
+                self._listeners[session] = on_browser
+            on_browser(self._pids())
+        self._schedule(session, time.time())
+        metrics.add_gauge("mux_sessions", 1)
+        try:
+            while not session.done.wait(1):
+                if stop_event.is_set() or self._closed:
+                    break
+        finally:
+            session.done.set()
+            with self._lock:
+                self._listeners.pop(session, None)
+            metrics.add_gauge("mux_sessions", -1)
+            portal_health.finish(chat_id)
+            send_notification(chat_id, "Script execution finished.")
+
+    def _pids(self):
+        with self._lock:
+            drivers = list(self._drivers.values())
+        return [pid for driver in drivers for pid in browser_pids(driver)]
+
+    def _set_driver(self, index, driver):
+        with self._lock:
+            if driver is None:
+                self._drivers.pop(index, None)
+            else:
+                self._drivers[index] = driver
+            listeners = list(self._listeners.values())
+        pids = self._pids()
+        for on_browser in listeners:
+            try:
+                on_browser(pids)
+            except Exception as e:
+                print(f"Error reporting multiplexed browsers: {e}")
+
+    def _schedule(self, session, due):
+        with self._condition:
+            heapq.heappush(self._due, (due, next(self._sequence), session))
+            self._condition.notify()
+
+    # Wait for the most overdue session; None once the multiplexer is closed
+    def _next(self):
+        with self._condition:
+            while not self._closed:
+                while self._due and self._due[0][2].done.is_set():
+                    heapq.heappop(self._due)
+                if not self._due:
+                    self._condition.wait()
+                    continue
+                wait = self._due[0][0] - time.time()
+                if wait <= 0:
+                    due, _, session = heapq.heappop(self._due)
+                    metrics.observe("mux_lag", -wait)
+                    return session
+                self._condition.wait(wait)
+        return None
+
+    def _serve(self, index):
+        driver = None
+        while True:
+            session = self._next()
+            if session is None:
+                break
+            pause = portal_health.wait_time()
+            if pause > 0:
+                # The portal is failing for everyone; try this user again after the shared backoff
+                self._schedule(session, time.time() + pause)
+                continue
+            if driver is None:
+                try:
+                    driver = create_driver()
+                    self._set_driver(index, driver)
+                except Exception as e:
+                    print(f"Error starting multiplexed browser: {e}")
+                    self._schedule(session, time.time() + 5)
+                    time.sleep(5)
+                    continue
+            try:
+                with metrics.span("mux_check"):
+                    self._check(driver, session)
+                session.errors = 0
+            except Exception as e:
+                session.errors += 1
+                print(f"Error checking attendance for {session.chat_id}: {e}")
+                portal_health.record_failure(session.chat_id, str(e))
+                if session.errors >= MUX_MAX_ERRORS and not portal_health.is_open():
+                    send_notification(session.chat_id, f"An error occurred in the main loop: {e}")
+                    session.done.set()
+                quit_driver(driver)
+                driver = None
+            if driver is not None and over_memory_cap(driver):
+                quit_driver(driver)
+                driver = None
+            if driver is None:
+                self._set_driver(index, None)
+            now = time.time()
+            if not session.done.is_set() and not session.stop_event.is_set() and now < session.end_time:
+                self._schedule(session, session.next_due(now))
+            else:
+                session.done.set()
+        if driver is not None:
+            quit_driver(driver)
+            self._set_driver(index, None)
+
+    # Switch the browser to the user, log in if the saved session expired, and click what is there
+    def _check(self, driver, session):
+        now = time.time()
+        if session.last_checked is not None:
+            metrics.observe("mux_staleness", now - session.last_checked)
+        switch_session(driver, get_portal_session(session.chat_id))
+        status = watch_page(driver, MUX_CHECK_TIMEOUT)
+        if status["state"] == "logged_out":
+            relogin(driver, session.username, session.password, session.chat_id)
+            status = watch_page(driver, MUX_CHECK_TIMEOUT)
+        if status["state"] == "buttons":
+            report_clicks(session.chat_id, status)
+        if status["state"] == "pending":
+            portal_health.record_failure(session.chat_id, "The portal page did not load.")
+        else:
+            portal_health.record_success(session.chat_id)
+        session.last_checked = time.time()
+
+    # Stop serving and quit the browsers; running sessions end as if cancelled.
+    # Checks in progress finish first, so no browser is quit under a thread still using it.
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        deadline = time.time() + MUX_CLOSE_TIMEOUT
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()))
+        with self._lock:
+            drivers = list(self._drivers.values())
+            self._drivers.clear()
+        for driver in drivers:
+            quit_driver(driver)
+
+_multiplexer = None
+_multiplexer_lock = threading.Lock()
+
+# The process-wide multiplexer, started on first use
+def get_multiplexer():
+    global _multiplexer
+    with _multiplexer_lock:
+        if _multiplexer is None:
+            _multiplexer = Multiplexer()
+            _multiplexer.start()
+        return _multiplexer
+
+def close_multiplexer():
+    if _multiplexer is not None:
+        _multiplexer.close()
@@ -0,0 +1,213 @@
+import os
+import time
+import asyncio
+from collections import defaultdict
+import metrics
+
+# Configuration Constants
+GLOBAL_RATE = 25  # Messages per second across all chats (Telegram allows about 30)
+CHAT_INTERVAL = 1.0  # Seconds between messages to the same chat
+COALESCE_WINDOW = float(os.getenv("NOTIFY_COALESCE_WINDOW", "1.0"))  # Messages to one chat within this window are merged
+MAX_MESSAGE_LENGTH = 4096
+MAX_ATTEMPTS = 3
+
+# aiohttp and requests are imported on first use, so attendance processes that only send
+# a few blocking messages do not pay for loading aiohttp at startup
+_http = None  # Keep-alive requests session, created on the first blocking send
+
+def _api_url():
+    base = os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org"
+    return f"{base.rstrip('/')}/bot{os.getenv('API_TOKEN')}/sendMessage"
+
+# Join queued texts into as few messages as Telegram's length limit allows
+def _merge(texts):
+    messages = []
+    for text in texts:
+        if messages and len(messages[-1]) + 1 + len(text) <= MAX_MESSAGE_LENGTH:
+            messages[-1] += "\n" + text
+        else:
+            messages.extend(text[i:i + MAX_MESSAGE_LENGTH] for i in range(0, max(len(text), 1), MAX_MESSAGE_LENGTH))
+    return messages
+
+# Asynchronous, rate-limited notification queue that merges bursts to the same chat.
+# One worker sends one message per turn; a chat with more to send, or one waiting out flood control
+# or a failed send, goes back on a timer so the other chats are not held up behind it.
+class Notifier:
+    def __init__(self):
+        self.loop = None
+        self._session = None
+        self._worker = None
+        self._ready = None
+        self._pending = defaultdict(list)
+        self._scheduled = set()  # Chats on a timer or in the ready queue
+        self._timers = {}
+        self._chat_next = {}
+        self._failures = {}
+        self._global_next = 0.0
+        self._processes = 1
+
+    # `processes` notifiers sharing one bot token split Telegram's limits between them
+    async def start(self, processes=1):
+        import aiohttp
+        self._processes = processes
+        self._client_error = aiohttp.ClientError
+        self.loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._session = aiohttp.ClientSession()
+        self._worker = asyncio.create_task(self._run())
+
+    # Queue a message; must be called on the notifier's event loop
+    def enqueue(self, chat_id, text):
+        self._pending[chat_id].append(text)
+        self._schedule(chat_id, COALESCE_WINDOW)
+
+    def enqueue_many(self, messages):
+        for chat_id, text in messages:
+            self.enqueue(chat_id, text)
+
+    def _schedule(self, chat_id, delay):
+        if chat_id in self._scheduled:
+            return
+        self._scheduled.add(chat_id)
+        self._timers[chat_id] = self.loop.call_later(max(delay, 0), self._due, chat_id)
+
+    def _due(self, chat_id):
+        self._timers.pop(chat_id, None)
+        self._ready.put_nowait(chat_id)
+
+    async def _run(self):
+        while True:
+            chat_id = await self._ready.get()
+            self._scheduled.discard(chat_id)
+            try:
+                await self._flush(chat_id)
+            except Exception as e:
+                print(f"Error sending notification: {e}")
+            finally:
+                self._ready.task_done()
+
+    async def _flush(self, chat_id):
+        now = time.monotonic()
+        if self._chat_next.get(chat_id, 0) > now:
+            self._schedule(chat_id, self._chat_next[chat_id] - now)
+            return
+        if self._global_next > now:
+            await asyncio.sleep(self._global_next - now)
+
+        messages = _merge(self._pending.pop(chat_id, []))
+        if not messages:
+            return
+        self._global_next = time.monotonic() + self._processes / GLOBAL_RATE
+        try:
+            retry_after = await self._send(chat_id, messages[0])
+        except self._client_error as e:
+            print(f"Error sending notification: {e}")
+            failures = self._failures[chat_id] = self._failures.get(chat_id, 0) + 1
+            retry_after = 2 ** (failures - 1) if failures < MAX_ATTEMPTS else 0
+        if retry_after:
+            # Flood control or a failed send: keep the message and try again once the delay has passed
+            delay = retry_after
+        else:
+            self._failures.pop(chat_id, None)
+            messages.pop(0)
+            delay = CHAT_INTERVAL * self._processes
+        if messages:
+            self._pending[chat_id][:0] = messages
+        self._chat_next[chat_id] = time.monotonic() + delay
+        if self._pending.get(chat_id):
+            self._schedule(chat_id, delay)
+
+    # Returns the retry_after delay when Telegram answers 429; a failed send raises aiohttp.ClientError
+    async def _send(self, chat_id, text):
+        with metrics.span("notification_send"):
+            async with self._session.post(_api_url(), json={"chat_id": chat_id, "text": text}) as response:
+                return await self._result(response)
+
+    async def _result(self, response):
+        if response.status == 429:
+            metrics.inc("notifications_rate_limited")
+            body = await response.json()
+            return body.get("parameters", {}).get("retry_after", 1)
+        if response.status < 500:
+            if response.status >= 400:
+                print(f"Error sending notification: {response.status} {await response.text()}")
+            return 0
+        response.raise_for_status()
+
+    # Wait until every queued message is sent or given up on, including chats waiting on a timer
+    async def _drain(self):
+        while True:
+            await self._ready.join()
+            if not self._pending and not self._timers:
+                return
+            await asyncio.sleep(0.05)
+
+    # Send what is queued without waiting out the merge window, then close the HTTP session
+    async def stop(self, timeout=10):
+        for chat_id, timer in list(self._timers.items()):
+            timer.cancel()
+            self._due(chat_id)
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            print("Notifications still queued at shutdown were dropped.")
+        self._worker.cancel()
+        await self._session.close()
+        self.loop = None
+
+notifier = Notifier()
+
+def _queue_metrics():
+    return {"notifications_queued": sum(len(texts) for texts in list(notifier._pending.values()))}
+
+metrics.register_collector(_queue_metrics)
+
+# Blocking send with a shared keep-alive session, used when no notifier loop is running
+def _send_now(chat_id, message):
+    global _http
+    import requests
+    if _http is None:
+        _http = requests.Session()
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with metrics.span("notification_send"):
+                response = _http.post(_api_url(), json={"chat_id": chat_id, "text": message}, timeout=10)
+            if response.status_code == 429:
+                metrics.inc("notifications_rate_limited")
+                time.sleep(response.json().get("parameters", {}).get("retry_after", 1))
+                continue
+            response.raise_for_status()
+            return
+        except requests.exceptions.RequestException as e:
+            print(f"Error sending notification: {e}")
+            time.sleep(2 ** attempt)
+
+# Function to send notifications via Telegram; safe to call from any thread
+def send_notification(chat_id, message):
+    metrics.inc("notifications")
+    loop = notifier.loop
+    if loop is None or loop.is_closed():
+        _send_now(chat_id, message)
+    elif _on_loop(loop):
+        notifier.enqueue(chat_id, message)
+    else:
+        loop.call_soon_threadsafe(notifier.enqueue, chat_id, message)
+
+# Send many (chat_id, message) pairs at once: one hop onto the notifier loop, which then paces them
+def send_notifications(messages):
+    messages = list(messages)
+    metrics.inc("notifications", len(messages))
+    loop = notifier.loop
+    if loop is None or loop.is_closed():
+        for chat_id, message in messages:
+            _send_now(chat_id, message)
+    elif _on_loop(loop):
+        notifier.enqueue_many(messages)
+    else:
+        loop.call_soon_threadsafe(notifier.enqueue_many, messages)
+
+def _on_loop(loop):
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
@@ -0,0 +1,119 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+import metrics
+from notifier import send_notification
+
+# Configuration Constants
+FAILURE_THRESHOLD = int(os.getenv("PORTAL_FAILURE_THRESHOLD", "3"))  # Failed checks in the window before the breaker can open
+FAILURE_RATIO = 0.5  # Share of recent checks that must have failed, so one broken browser cannot open it alone
+HEALTH_WINDOW = 120  # Seconds of check results considered
+BACKOFF_BASE = int(os.getenv("PORTAL_BACKOFF_BASE", "15"))  # First pause after the breaker opens, in seconds
+BACKOFF_MAX = int(os.getenv("PORTAL_BACKOFF_MAX", "600"))
+POLL_JITTER = 0.1  # Poll intervals are spread by ±10% so sessions started together drift apart
+
+# Circuit breaker over the portal shared by every session in the process.
+# Closed: sessions poll normally. Open: everyone waits out a jittered, exponentially growing pause.
+# Half-open: one session probes; its result closes the breaker or opens it again for longer.
+# Users who hit failures get one summary when the portal works for them again, not one message per cycle.
+class PortalHealth:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._results = deque()  # (time, ok)
+        self.state = "closed"
+        self.opened_at = None
+        self.retry_at = 0
+        self._openings = 0
+        self._probe_started = None
+        self._affected = {}  # chat_id -> [first failure time, failed checks, last reason]
+
+    # Seconds a session should wait before touching the portal; 0 means go ahead
+    def wait_time(self):
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            now = time.time()
+            if now < self.retry_at:
+                return self.retry_at - now + random.uniform(0, 1)
+            # Let one session probe; a probe that never reported back is replaced after a while
+            if self._probe_started is None or now - self._probe_started > BACKOFF_BASE * 4:
+                self.state = "half_open"
+                self._probe_started = now
+                return 0
+            return random.uniform(BACKOFF_BASE / 2, BACKOFF_BASE)
+
+    def is_open(self):
+        return self.state != "closed"
+
+    def _trim(self, now):
+        while self._results and self._results[0][0] < now - HEALTH_WINDOW:
+            self._results.popleft()
+
+    def record_failure(self, chat_id, reason):
+        now = time.time()
+        metrics.inc("portal_failures")
+        with self._lock:
+            self._results.append((now, False))
+            self._trim(now)
+            affected = self._affected.setdefault(chat_id, [now, 0, reason])
+            affected[1] += 1
+            affected[2] = reason
+            failures = sum(1 for _, ok in self._results if not ok)
+            if self.state == "half_open" or (
+                self.state == "closed" and failures >= FAILURE_THRESHOLD and failures >= FAILURE_RATIO * len(self._results)
+            ):
+                self._open(now)
+
+    def _open(self, now):
+        if self.state == "closed":
+            self.opened_at = now
+        self._openings += 1
+        pause = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._openings - 1))
+        self.retry_at = now + random.uniform(pause / 2, pause)
+        self.state = "open"
+        self._probe_started = None
+        metrics.inc("portal_breaker_opened")
+        metrics.set_gauge("portal_breaker_open", 1)
+        print(f"Portal unhealthy, pausing checks for {self.retry_at - now:.0f}s.")
+
+    def record_success(self, chat_id):
+        now = time.time()
+        with self._lock:
+            self._results.append((now, True))
+            self._trim(now)
+            if self.state != "closed":
+                print(f"Portal recovered after {(now - self.opened_at) / 60:.1f} min.")
+                self.state = "closed"
+                self._openings = 0
+                self._probe_started = None
+                metrics.set_gauge("portal_breaker_open", 0)
+            affected = self._affected.pop(chat_id, None)
+        if affected is not None:
+            first, failures, _ = affected
+            minutes = max(1, round((now - first) / 60))
+            send_notification(chat_id, f"Портал не отвечал около {minutes} мин (неудачных проверок: {failures}). Отметка продолжается.")
+
+    # Summarise a problem that lasted until the end of the user's session
+    def finish(self, chat_id):
+        with self._lock:
+            affected = self._affected.pop(chat_id, None)
+        if affected is not None:
+            first, failures, reason = affected
+            minutes = max(1, round((time.time() - first) / 60))
+            send_notification(
+                chat_id,
+                f"Портал не отвечал до конца сеанса, последние {minutes} мин (неудачных проверок: {failures}). Последняя ошибка: {reason}",
+            )
+
+# Delay before a session's next poll: the scheduled delay spread by a little jitter,
+# stretched after consecutive failures to a jittered exponential backoff
+def next_delay(scheduled, failures=0):
+    delay = scheduled * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+    if failures:
+        pause = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (failures - 1))
+        delay = max(delay, random.uniform(pause / 2, pause))
+    return delay
+
+portal_health = PortalHealth()
@@ -0,0 +1,82 @@
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from db import get_user_schedule
+
+# Configuration Constants
+TIMETABLE_TZ = timezone(timedelta(hours=int(os.getenv("TIMETABLE_UTC_OFFSET", "5"))))  # Almaty time
+WINDOW_BEFORE = int(os.getenv("POLL_WINDOW_BEFORE", "300"))  # Seconds before a lesson starts to begin dense polling
+WINDOW_AFTER = int(os.getenv("POLL_WINDOW_AFTER", "1200"))  # Seconds after a lesson starts to keep polling
+DENSE_INTERVAL = int(os.getenv("POLL_DENSE_INTERVAL", "10"))
+
+WEEKDAYS = ["пн", "вт", "ср", "чт", "пт", "сб", "вс"]
+
+# Parse lines like "Пн 09:00" into (weekday, "HH:MM") pairs
+def parse_schedule(text):
+    lessons = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = re.fullmatch(r"(\S+)\s+(\d{1,2}):(\d{2})", line)
+        if match is None or match.group(1).lower()[:2] not in WEEKDAYS:
+            raise ValueError(f"Неверная строка расписания: {line}")
+        hour, minute = int(match.group(2)), int(match.group(3))
+        if hour > 23 or minute > 59:
+            raise ValueError(f"Неверное время: {line}")
+        lessons.append((WEEKDAYS.index(match.group(1).lower()[:2]), f"{hour:02d}:{minute:02d}"))
+    return sorted(set(lessons))
+
+def format_schedule(lessons):
+    return "\n".join(f"{WEEKDAYS[weekday].capitalize()} {start_time}" for weekday, start_time in lessons)
+
+# Timestamps of lesson starts between `start` and `end`
+def lesson_times(lessons, start, end):
+    day = datetime.fromtimestamp(start, TIMETABLE_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    times = []
+    while day.timestamp() <= end:
+        for weekday, start_time in lessons:
+            if weekday == day.weekday():
+                hour, minute = map(int, start_time.split(":"))
+                moment = day.replace(hour=hour, minute=minute).timestamp()
+                if start <= moment <= end:
+                    times.append(moment)
+        day += timedelta(days=1)
+    return sorted(times)
+
+# Start of the user's current or next lesson, None without a timetable
+def next_lesson(lessons, now, after=WINDOW_AFTER):
+    times = lesson_times(lessons, now - after, now + 8 * 86400) if lessons else []
+    return times[0] if times else None
+
+# Decides how long to wait before the next attendance check
+class PollScheduler:
+    def __init__(self, lessons, fallback_interval, dense_interval=DENSE_INTERVAL, before=WINDOW_BEFORE, after=WINDOW_AFTER):
+        self.lessons = lessons
+        self.fallback_interval = fallback_interval
+        self.dense_interval = dense_interval
+        self.before = before
+        self.after = after
+
+    @classmethod
+    def for_user(cls, user_id, fallback_interval):
+        return cls(get_user_schedule(user_id), fallback_interval)
+
+    def _windows(self, now):
+        return [(t - self.before, t + self.after) for t in lesson_times(self.lessons, now - self.after, now + 8 * 86400)]
+
+    def in_window(self, now=None):
+        now = time.time() if now is None else now
+        return any(start <= now < end for start, end in self._windows(now))
+
+    # Dense polling inside a lesson window, otherwise sleep until the next window opens
+    def next_delay(self, now=None):
+        now = time.time() if now is None else now
+        if not self.lessons:
+            return self.fallback_interval
+        windows = self._windows(now)
+        if any(start <= now < end for start, end in windows):
+            return self.dense_interval
+        upcoming = [start for start, end in windows if start > now]
+        return upcoming[0] - now if upcoming else self.fallback_interval
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+# Startup profiler: records how long each launch phase takes, counted from the first import of this module.
+# Enabled with --profile-startup on the command line or PROFILE_STARTUP=1.
+ENABLED = "--profile-startup" in sys.argv or os.getenv("PROFILE_STARTUP") == "1"
+
+_start = time.perf_counter()
+_start_wall = time.time()
+_marks = {}
+_phases = {}
+_reported = False
+
+# Record the first time a milestone is reached
+def mark(name):
+    if name not in _marks:
+        _marks[name] = time.perf_counter() - _start
+
+# Time a launch phase; only its first run is kept, so repeated work later in the run does not skew it
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.setdefault(name, time.perf_counter() - started)
+
+# Seconds the interpreter spent starting before the first import of this module
+def _interpreter_time():
+    try:
+        import psutil
+        return max(0.0, _start_wall - psutil.Process().create_time())
+    except Exception:
+        return None
+
+def report():
+    return {
+        "interpreter": _interpreter_time(),
+        "marks": {name: round(value, 4) for name, value in _marks.items()},
+        "phases": {name: round(value, 4) for name, value in _phases.items()},
+    }
+
+# Print the report once as a single JSON line (read by startup_check.py)
+def emit():
+    global _reported
+    if not ENABLED or _reported:
+        return
+    _reported = True
+    print("STARTUP_PROFILE " + json.dumps(report()), flush=True)
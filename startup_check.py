@@ -0,0 +1,85 @@
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+
+# Configuration Constants
+IMPORT_BUDGET = float(os.getenv("STARTUP_IMPORT_BUDGET", "1.5"))  # Seconds to import auto_attend in a fresh interpreter
+FIRST_POLL_BUDGET = float(os.getenv("STARTUP_FIRST_POLL_BUDGET", "20"))  # Seconds from process start to the first poll
+# Modules the attendance process must never load
+FORBIDDEN_MODULES = ("bot", "aiogram", "aiohttp", "dotenv", "webdriver_manager", "http_engine")
+
+# Import auto_attend with -X importtime and return (seconds, imported module names)
+def measure_imports():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import auto_attend"],
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        if match is None:
+            continue
+        modules.add(match.group(3).split(".")[0])
+        if len(match.group(2)) == 1:  # Top-level imports; their cumulative times add up to the whole
+            total += int(match.group(1))
+    return total / 1e6, modules
+
+# Launch auto_attend with the profiler on and stop it as soon as it reports the first poll
+def measure_first_poll(args):
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "auto_attend.py", "--profile-startup", *args],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        for line in process.stdout:
+            if line.startswith("STARTUP_PROFILE "):
+                profile = json.loads(line.split(" ", 1)[1])
+                profile["wall"] = time.perf_counter() - started
+                return profile
+            if time.perf_counter() - started > FIRST_POLL_BUDGET * 3:
+                break
+        return None
+    finally:
+        process.kill()
+        process.wait()
+
+# Exit with status 1 when a startup budget is exceeded
+def main():
+    failures = []
+    seconds, modules = measure_imports()
+    print(f"Import time: {seconds:.3f}s (budget {IMPORT_BUDGET}s)")
+    if seconds > IMPORT_BUDGET:
+        failures.append("import time over budget")
+    loaded = sorted(set(FORBIDDEN_MODULES) & modules)
+    if loaded:
+        failures.append(f"heavy modules imported at startup: {', '.join(loaded)}")
+
+    if sys.argv[1:2] == ["--first-poll"]:
+        if len(sys.argv) < 7:
+            print("Usage: python startup_check.py [--first-poll [--engine=http|selenium] <username> <password> <duration_in_minutes> <chat_id> <bot_token>]")
+            return 1
+        profile = measure_first_poll(sys.argv[2:])
+        if profile is None:
+            failures.append("first poll never happened")
+        else:
+            first_poll = profile["marks"]["first_poll"] + (profile["interpreter"] or 0)
+            print(f"Time to first poll: {first_poll:.3f}s (budget {FIRST_POLL_BUDGET}s)")
+            for name, value in profile["phases"].items():
+                print(f"  {name}: {value:.3f}s")
+            if first_poll > FIRST_POLL_BUDGET:
+                failures.append("time to first poll over budget")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+# Entry point of the script
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import os
+import time
+import uuid
+import socket
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+from db import (
+    update_session_browsers, register_session_async, unregister_session_async, heartbeat_sessions_async,
+    request_session_cancel_async, get_active_session_async, get_session_owners_async, take_stale_sessions_async,
+    get_user_credentials_async, get_user_schedule_async,
+)
+from notifier import send_notification
+from browser import PORTAL_URL, create_driver, quit_driver, browser_pids, reap_browsers
+from auto_attend import run as attend_run
+from multiplexer import MUX_BROWSERS, get_multiplexer
+from scheduler import next_lesson
+from admission import AdmissionController, ADMISSION_INTERVAL
+
+# Configuration Constants
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "20"))  # Sessions running at once at most; memory and CPU may admit fewer
+SESSION_HEARTBEAT = 15  # Seconds between registry heartbeats
+SESSION_STALE_AFTER = 60  # A session whose owner has not heartbeated for this long is taken over
+
+# Run one attendance session on this thread, borrowing a pooled browser when there is one.
+# With MUX_BROWSERS set, Selenium sessions share the multiplexer's browsers instead.
+def run_attendance(browser_pool, engine, username, password, duration, chat_id, bot_token, stop_event, on_browser=None):
+    args = (username, password, duration, chat_id, bot_token)
+    if engine == "http":
+        # A failed HTTP start falls back to a browser of its own, reported through on_browser
+        attend_run(engine, *args, stop_event=stop_event, on_browser=on_browser)
+        return
+    if MUX_BROWSERS > 0:
+        get_multiplexer().run(username, password, duration, chat_id, stop_event, on_browser=on_browser)
+        return
+    try:
+        if browser_pool is not None:
+            driver = browser_pool.acquire()
+        else:
+            driver = create_driver()
+            driver.get(PORTAL_URL)
+    except Exception as e:
+        send_notification(chat_id, f"Ошибка при запуске: {e}")
+        return
+    if on_browser is not None:
+        on_browser(browser_pids(driver))
+    try:
+        attend_run(engine, *args, driver=driver, stop_event=stop_event, on_browser=on_browser)
+    finally:
+        if browser_pool is not None:
+            browser_pool.release(driver)
+        else:
+            quit_driver(driver)
+
+# One user's attendance run
+class Session:
+    def __init__(self, user_id, engine, duration):
+        self.user_id = user_id
+        self.engine = engine
+        self.duration = duration
+        self.state = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.deadline = None
+        self.stop_event = threading.Event()
+        self.registered_at = None  # started_at of the session's active_sessions row
+        self.task = None
+        self.waited = False  # Told they are in line, so they hear when it starts
+
+    def status(self):
+        return {
+            "state": self.state,
+            "engine": self.engine,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "deadline": self.deadline,
+        }
+
+# Runs attendance sessions as asyncio tasks, with the blocking browser work on a bounded thread pool.
+# Launches the host has no room for wait in the admission controller, soonest lesson first.
+# Every session is also recorded in the active_sessions table so a restarted bot can take it over.
+class SessionSupervisor:
+    def __init__(self, max_sessions=MAX_SESSIONS, browser_pool=None):
+        self.browser_pool = browser_pool
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions, thread_name_prefix="attend")
+        self.admission = AdmissionController(max_sessions)
+        self.sessions = {}
+        self.host = socket.gethostname()
+        self.owner = self._new_owner()
+        self._watcher = None
+        self._admitter = None
+        self._closing = False
+
+    # PIDs get reused (a container's bot is always PID 1), so owners also carry a random suffix
+    def _new_owner(self):
+        return f"{self.host}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    # Take over sessions left by dead processes, then keep heartbeating
+    async def start_watcher(self):
+        self.owner = self._new_owner()  # Forked webhook workers need their own identity
+        await self._recover(startup=True)
+        self._watcher = asyncio.get_running_loop().create_task(self._watch())
+        self._admitter = asyncio.get_running_loop().create_task(self._admit_loop())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(SESSION_HEARTBEAT)
+            try:
+                for user_id in await heartbeat_sessions_async(self.owner):
+                    self._stop(user_id)
+                await self._recover()
+            except Exception as e:
+                print(f"Error in session watcher: {e}")
+
+    # Reap browsers of orphaned sessions and resume the ones with time left
+    async def _recover(self, startup=False):
+        dead_owners = []
+        if startup:
+            for owner, host in await get_session_owners_async():
+                pid = int(owner.split("-")[-2])
+                if host == self.host and owner != self.owner and (pid == os.getpid() or not psutil.pid_exists(pid)):
+                    dead_owners.append(owner)
+        loop = asyncio.get_running_loop()
+        for user_id, host, engine, pids, deadline, cancel_requested in await take_stale_sessions_async(time.time() - SESSION_STALE_AFTER, dead_owners):
+            if host == self.host:
+                await loop.run_in_executor(None, reap_browsers, pids)
+            minutes_left = (deadline - time.time()) / 60
+            if cancel_requested or minutes_left < 1:
+                continue
+            credentials = await get_user_credentials_async(user_id)
+            if credentials is None:
+                continue
+            username, password, _ = credentials
+            if await self.start(user_id, engine, username, password, minutes_left, user_id, os.getenv("API_TOKEN")):
+                send_notification(user_id, "Процесс отметки восстановлен после перезапуска бота.")
+
+    # Start a session for the user, or put it in line when the host is full; returns None if they already have one anywhere
+    async def start(self, user_id, engine, username, password, duration, chat_id, bot_token):
+        if user_id in self.sessions:
+            return None
+        registered_at = await register_session_async(user_id, self.owner, self.host, engine, time.time() + duration * 60)
+        if registered_at is None:
+            return None
+        session = Session(user_id, engine, duration)
+        session.registered_at = registered_at
+        self.sessions[user_id] = session
+        args = (username, password, duration, chat_id, bot_token)
+        # Users whose lesson starts soonest go first; without a timetable, the time they asked counts as the lesson
+        priority = next_lesson(await get_user_schedule_async(user_id), time.time()) or time.time()
+        # Keyed by the session: a cancelled one may still be winding down when the user starts the next
+        self.admission.enqueue(session, engine, priority, (session, args))
+        self._admit()
+        session.waited = session.task is None
+        return session
+
+    # Start every waiting session the host has room for
+    def _admit(self):
+        loop = asyncio.get_running_loop()
+        for session, args in self.admission.admit():
+            if session.waited:
+                send_notification(session.user_id, "Освободилось место, запускаем авто отметку.")
+            session.task = loop.create_task(self._run(session, args))
+
+    # Memory and CPU free up without a session ending, so waiting launches are retried periodically too
+    async def _admit_loop(self):
+        while True:
+            await asyncio.sleep(ADMISSION_INTERVAL)
+            if self.admission.waiting_count():
+                try:
+                    self._admit()
+                except Exception as e:
+                    print(f"Error admitting sessions: {e}")
+
+    async def _run(self, session, args):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, self._attend, session, args)
+        except Exception as e:
+            print(f"Error in session for user {session.user_id}: {e}")
+        finally:
+            session.state = "finished"
+            self.admission.finished(session)
+            if self.sessions.get(session.user_id) is session:
+                del self.sessions[session.user_id]
+            self._admit()
+            # Sessions interrupted by shutdown stay registered so the next start resumes them
+            if not self._closing:
+                await unregister_session_async(session.user_id, self.owner, session.registered_at)
+
+    # Runs on a pool thread
+    def _attend(self, session, args):
+        if session.stop_event.is_set():
+            return
+        session.state = "running"
+        session.started_at = time.time()
+        session.deadline = session.started_at + session.duration * 60
+
+        def on_browser(pids):
+            self.admission.set_browsers(session, pids)
+            update_session_browsers(session.user_id, self.owner, session.registered_at, pids)
+
+        run_attendance(self.browser_pool, session.engine, *args, session.stop_event, on_browser=on_browser)
+
+    # Ask the user's session to stop without waiting for it, wherever it runs.
+    # The row is marked cancelled even when the session is ours, so status() elsewhere stops reporting it
+    # while it winds down and a new start can replace it.
+    async def cancel(self, user_id):
+        stopped = self._stop(user_id)
+        return await request_session_cancel_async(user_id) or stopped
+
+    def _stop(self, user_id):
+        session = self.sessions.pop(user_id, None)
+        if session is None:
+            return False
+        session.state = "stopping"
+        session.stop_event.set()
+        # A session still waiting in line has no task to clean up after it
+        if session.task is None and self.admission.discard(session) and not self._closing:
+            asyncio.get_running_loop().create_task(unregister_session_async(user_id, self.owner, session.registered_at))
+        return True
+
+    async def status(self, user_id):
+        session = self.sessions.get(user_id)
+        if session is not None:
+            status = session.status()
+            status["position"] = self.admission.position(session)
+            return status
+        record = await get_active_session_async(user_id)
+        if record is None or record[4]:
+            return None
+        owner, engine, started_at, deadline, _ = record
+        return {"state": "running", "engine": engine, "created_at": started_at, "started_at": started_at, "deadline": deadline}
+
+    def active_count(self):
+        return sum(1 for session in self.sessions.values() if session.state == "running")
+
+    # Stop every session and release the worker threads
+    def shutdown(self):
+        self._closing = True
+        if self._watcher is not None:
+            self._watcher.cancel()
+        if self._admitter is not None:
+            self._admitter.cancel()
+        for user_id in list(self.sessions):
+            self._stop(user_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,37 @@
+import os
+import sys
+import socket
+import tempfile
+import pytest
+
+# The modules live in the repository root and read their settings at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="tests-"), "test.db")
+os.environ.setdefault("API_TOKEN", "123456:test")
+
+from mock_portal import MockPortal, PORTAL_PATH, start_in_thread
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+# One mock portal for the whole run; tests reset it and set their own button delay
+@pytest.fixture(scope="session")
+def portal_server():
+    portal = MockPortal()
+    base_url = start_in_thread(portal, port=_free_port())
+    # Notifications from the engines go to the mock's fake Bot API
+    os.environ["TELEGRAM_API_URL"] = base_url
+    return portal, base_url
+
+@pytest.fixture
+def portal(portal_server):
+    portal, _ = portal_server
+    portal.reset()
+    portal.button_delay = 0
+    return portal
+
+@pytest.fixture
+def portal_url(portal_server):
+    return portal_server[1] + PORTAL_PATH
@@ -0,0 +1,46 @@
+import pytest
+import admission
+from admission import AdmissionController
+
+class _Memory:
+    available = 64 * 1024 * admission.MB
+
+# An idle host with plenty of memory, whatever the machine running the tests is doing
+@pytest.fixture
+def idle_host(monkeypatch):
+    monkeypatch.setattr(admission.psutil, "getloadavg", lambda: (0.0, 0.0, 0.0))
+    monkeypatch.setattr(admission.psutil, "virtual_memory", lambda: _Memory())
+
+def test_idle_host_admits_up_to_max_sessions(idle_host):
+    controller = AdmissionController(20)
+    admitted = []
+    for user_id in range(25):
+        controller.enqueue(user_id, "selenium", user_id, user_id)
+        admitted += controller.admit()
+    assert admitted == list(range(20))
+    assert controller.waiting_count() == 5
+
+def test_busy_cpu_holds_launches(idle_host, monkeypatch):
+    monkeypatch.setattr(admission.psutil, "getloadavg", lambda: (admission.psutil.cpu_count() * 2.0,) * 3)
+    controller = AdmissionController(20)
+    controller.enqueue(1, "http", 0, 1)
+    assert controller.admit() == []
+    assert controller.position(1) == 1
+
+def test_waiting_launches_admitted_by_priority(idle_host):
+    controller = AdmissionController(1)
+    controller.started("running", "selenium")
+    controller.enqueue("late", "selenium", 300, "late")
+    controller.enqueue("soon", "selenium", 100, "soon")
+    controller.enqueue("middle", "selenium", 200, "middle")
+    assert controller.admit() == []
+    assert [controller.position(key) for key in ("soon", "middle", "late")] == [1, 2, 3]
+
+    assert controller.discard("middle")
+    assert controller.position("late") == 2
+    controller.finished("running")
+    assert controller.admit() == ["soon"]
+    assert controller.position("late") == 1
+    controller.finished("soon")
+    assert controller.admit() == ["late"]
+    assert controller.position("late") is None
@@ -0,0 +1,137 @@
+import sqlite3
+import pytest
+import db
+
+# Every test starts from empty tables in the temporary database set up by conftest
+@pytest.fixture(autouse=True)
+def fresh_db():
+    db.init_db()
+    with db.transaction() as conn:
+        for table in ("users", "requests", "portal_sessions", "jobs", "active_sessions"):
+            conn.execute(f"DELETE FROM {table}")
+    db._user_cache.invalidate()
+
+def _request_ids():
+    rows, _, _ = db.get_requests_page(0, False, 100)
+    return [row[0] for row in rows]
+
+def test_request_pages():
+    for user_id in range(1, 6):
+        db.save_user_request(user_id, f"user{user_id}", "secret")
+    ids = _request_ids()
+    rows, has_prev, has_next = db.get_requests_page(0, False, 2)
+    assert [row[0] for row in rows] == ids[:2] and not has_prev and has_next
+    rows, has_prev, has_next = db.get_requests_page(ids[1], False, 2)
+    assert [row[0] for row in rows] == ids[2:4] and has_prev and has_next
+    rows, has_prev, has_next = db.get_requests_page(ids[2], True, 2)
+    assert [row[0] for row in rows] == ids[:2] and not has_prev and has_next
+
+def test_first_page_redrawn_after_decision_has_no_previous():
+    for user_id in range(1, 4):
+        db.save_user_request(user_id, f"user{user_id}", "secret")
+    ids = _request_ids()
+    db.approve_user_request(ids[0])
+    # The bot redraws the page from just before its first request
+    rows, has_prev, _ = db.get_requests_page(ids[0] - 1, False, 10)
+    assert [row[0] for row in rows] == ids[1:]
+    assert not has_prev
+
+def _expire_leases():
+    with db.transaction() as conn:
+        conn.execute("UPDATE jobs SET lease_expires = 0 WHERE status = 'running'")
+
+def test_one_active_job_per_user():
+    job_id = db.enqueue_job(1, 30)
+    assert job_id is not None
+    assert db.enqueue_job(1, 30) is None
+    assert db.cancel_user_jobs(1)
+    assert db.enqueue_job(1, 30) is not None
+
+def test_claim_takes_over_expired_lease():
+    job_id = db.enqueue_job(1, 30)
+    claimed_id, user_id, deadline = db.claim_job("worker-a", 60)
+    assert (claimed_id, user_id) == (job_id, 1)
+    assert db.claim_job("worker-b", 60) is None
+
+    _expire_leases()
+    assert db.claim_job("worker-b", 60) == (job_id, 1, deadline)  # Same window, not a fresh one
+    assert not db.heartbeat_job(job_id, "worker-a", 60)
+    assert db.heartbeat_job(job_id, "worker-b", 60)
+    db.finish_job(job_id, "worker-a", "done")  # The old worker's late finish is ignored
+    assert db.get_user_job(1)[1] == "running"
+
+def test_job_requeued_on_shutdown_resumes_its_window():
+    job_id = db.enqueue_job(1, 30)
+    _, _, deadline = db.claim_job("worker-a", 60)
+    db.finish_job(job_id, "worker-a", "queued")
+    assert db.get_user_job(1)[1] == "queued"
+    assert db.claim_job("worker-b", 60) == (job_id, 1, deadline)
+
+def test_cancelled_running_job_stops_and_finishes_cancelled():
+    job_id = db.enqueue_job(1, 30)
+    db.claim_job("worker-a", 60)
+    assert db.cancel_user_jobs(1)
+    assert not db.heartbeat_job(job_id, "worker-a", 60)
+    db.finish_job(job_id, "worker-a", "done")
+    with db.transaction() as conn:
+        assert conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()[0] == "cancelled"
+
+def test_expired_job_is_not_claimed():
+    job_id = db.enqueue_job(1, 30)
+    db.claim_job("worker-a", 60)
+    with db.transaction() as conn:
+        conn.execute("UPDATE jobs SET lease_expires = 0, deadline = 1 WHERE job_id = ?", (job_id,))
+    assert db.claim_job("worker-b", 60) is None
+    assert db.get_user_job(1) is None
+
+def test_session_registered_once_per_user():
+    started_at = db.register_session(1, "owner-a", "host", "selenium", 9e9)
+    assert started_at is not None
+    assert db.register_session(1, "owner-a", "host", "http", 9e9) is None
+    assert db.register_session(1, "owner-b", "host", "http", 9e9) is None
+    db.unregister_session(1, "owner-b", started_at)  # Not the owner
+    assert db.get_active_session(1)[0] == "owner-a"
+    db.unregister_session(1, "owner-a", started_at)
+    assert db.get_active_session(1) is None
+
+def test_cancelled_session_replaced_by_same_owner_only():
+    old = db.register_session(1, "owner-a", "host", "selenium", 9e9)
+    assert db.request_session_cancel(1)
+    assert db.heartbeat_sessions("owner-a") == [1]
+    assert db.register_session(1, "owner-b", "host", "http", 9e9) is None
+
+    new = db.register_session(1, "owner-a", "host", "http", 9e9)
+    assert new is not None and new != old
+    assert db.get_active_session(1) == ("owner-a", "http", new, 9e9, 0)
+    assert db.heartbeat_sessions("owner-a") == []
+
+    # The old session winding down must not touch its replacement's row
+    db.update_session_browsers(1, "owner-a", old, [123])
+    db.unregister_session(1, "owner-a", old)
+    assert db.get_active_session(1) is not None
+    assert db.take_stale_sessions(0, ["owner-a"]) == [(1, "host", "http", [], 9e9, 0)]
+
+def test_one_pending_request_per_user():
+    db.save_user_request(1, "old-name", "old")
+    db.save_user_request(1, "new-name", "new")
+    db.save_user_request(2, "other", "secret")
+    rows, _, _ = db.get_requests_page(0, False, 10)
+    assert [(user_id, username) for _, user_id, username, _ in rows] == [(1, "new-name"), (2, "other")]
+
+    assert db.approve_user_request(rows[0][0]) == (1, "new-name")
+    assert db.get_user_credentials(1)[:2] == ("new-name", "new")
+    db.save_user_request(1, "again", "secret")  # A decided request does not block a new one
+    assert len(db.get_requests_page(0, False, 10)[0]) == 2
+
+def test_requests_migration_supersedes_duplicates():
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    conn.execute("CREATE TABLE requests (request_id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, username TEXT NOT NULL, password TEXT NOT NULL, status TEXT DEFAULT 'pending')")
+    conn.executemany(
+        "INSERT INTO requests (user_id, username, password, status) VALUES (?, ?, ?, ?)",
+        [(1, "a", "p", "pending"), (1, "b", "p", "pending"), (2, "c", "p", "approved"), (1, "d", "p", "pending")],
+    )
+    db._requests_lifecycle(conn)
+    rows = conn.execute("SELECT request_id, status, created_at IS NOT NULL, decided_at IS NOT NULL FROM requests ORDER BY request_id").fetchall()
+    assert rows == [(1, "superseded", 1, 1), (2, "superseded", 1, 1), (3, "approved", 1, 1), (4, "pending", 1, 0)]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO requests (user_id, username, password) VALUES (1, 'e', 'p')")
@@ -0,0 +1,79 @@
+import time
+import pytest
+import http_engine
+from http_engine import VaadinClient, VaadinError, SessionExpired, new_session, login, try_to_attend, ATTEND_CAPTION, NO_COURSES_TEXT
+
+@pytest.fixture
+def client(portal, portal_url):
+    client = VaadinClient(new_session(), url=portal_url)
+    yield client
+    client.close()
+
+def test_bootstrap_reads_login_form(client):
+    client.bootstrap()
+    assert client.ui_id == 0
+    assert client.csrf_token
+    assert client.logged_out()
+    assert client.find("TextField") == ["1"]
+
+def test_bootstrap_without_vaadin_page(portal_server, portal):
+    client = VaadinClient(new_session(), url=portal_server[1] + "/mock/state")
+    with pytest.raises(VaadinError):
+        client.bootstrap()
+
+def test_login(client, portal):
+    portal.button_delay = 60
+    client.bootstrap()
+    login(client, "student", "secret")
+    assert not client.logged_out()
+    assert client.has_text(NO_COURSES_TEXT)
+    assert portal.logins == 1
+
+def test_login_rejected(client, portal):
+    client.bootstrap()
+    with pytest.raises(VaadinError):
+        login(client, "student", "")
+    assert portal.logins == 0
+
+def test_buttons_and_click(client, portal):
+    client.bootstrap()
+    login(client, "student", "secret")
+    client.sync()
+    buttons = client.buttons(ATTEND_CAPTION)
+    assert buttons == ["10"]
+    client.rpc([client.click(buttons[0])])
+    assert len(portal.marks["student"]["clicked"]) == 1
+    assert client.buttons(ATTEND_CAPTION) == []
+
+def test_try_to_attend_clicks_and_notifies(client, portal):
+    client.bootstrap()
+    login(client, "student", "secret")
+    try_to_attend(client, 42)
+    assert len(portal.marks["student"]["clicked"]) == 1
+    deadline = time.time() + 5
+    while not portal.messages and time.time() < deadline:
+        time.sleep(0.05)
+    assert [(chat_id, text) for chat_id, text, _ in portal.messages] == [("42", "Attendance successful!")]
+
+def test_saved_cookies_skip_login(client, portal, portal_url):
+    client.bootstrap()
+    login(client, "student", "secret")
+    again = VaadinClient(new_session(), url=portal_url)
+    again.add_cookies(client.get_cookies())
+    again.bootstrap()
+    assert not again.logged_out()
+    again.close()
+
+def test_session_expired(client, portal):
+    client.bootstrap()
+    portal.sessions.clear()
+    with pytest.raises(SessionExpired):
+        client.sync()
+
+def test_close_keeps_shared_pool(client, portal, portal_url):
+    client.bootstrap()
+    other = VaadinClient(new_session(), url=portal_url)
+    other.bootstrap()
+    other.close()
+    assert len(http_engine._adapter.poolmanager.pools) == 1
+    client.sync()
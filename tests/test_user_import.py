@@ -0,0 +1,32 @@
+import json
+import pytest
+from user_import import parse_users, dump_users
+
+def test_csv_round_trip():
+    rows = [(1, "alice", "secret", 60, "http"), (2, "bob", "pass, with comma", 45, "selenium")]
+    assert parse_users("users.csv", dump_users(rows)) == rows
+
+def test_csv_optional_columns_left_out():
+    assert parse_users("users.csv", b"user_id,username,password\n123,alice,secret\n") == [(123, "alice", "secret", None, None)]
+
+@pytest.mark.parametrize("data", [
+    b"user_id,username,password\n123,alice\n",
+    b"user_id,username,password\n123\n",
+    b"user_id,username\n123,alice\n",
+])
+def test_csv_short_rows_rejected(data):
+    with pytest.raises(ValueError, match="Строка 2"):
+        parse_users("users.csv", data)
+
+def test_json_numeric_password():
+    data = json.dumps([{"user_id": 7, "username": "carol", "password": 12345}]).encode()
+    assert parse_users("users.json", data) == [(7, "carol", "12345", None, None)]
+
+def test_json_null_password_rejected():
+    data = json.dumps([{"user_id": 7, "username": "carol", "password": None}]).encode()
+    with pytest.raises(ValueError, match="нет поля password"):
+        parse_users("users.json", data)
+
+def test_unknown_engine_rejected():
+    with pytest.raises(ValueError, match="неизвестный движок"):
+        parse_users("users.csv", b"user_id,username,password,engine\n1,a,b,firefox\n")
@@ -0,0 +1,58 @@
+import io
+import csv
+import json
+
+# Columns of an import/export file; default_duration and engine may be left out on import to keep the current values
+COLUMNS = ["user_id", "username", "password", "default_duration", "engine"]
+ENGINES = ("http", "selenium")
+
+def _row(record, number):
+    # Short CSV rows and JSON nulls come through as None, which str() would turn into "None"
+    missing = [column for column in COLUMNS[:3] if record.get(column) is None]
+    if missing:
+        raise ValueError(f"Строка {number}: нет поля {missing[0]}.")
+    try:
+        user_id = int(record["user_id"])
+        username = str(record["username"]).strip()
+        password = str(record["password"])
+        duration = int(record["default_duration"]) if record.get("default_duration") else None
+    except (TypeError, ValueError):
+        raise ValueError(f"Строка {number}: user_id и default_duration должны быть числами.")
+    engine = str(record.get("engine") or "").strip().lower() or None
+    if not username or not password:
+        raise ValueError(f"Строка {number}: пустой логин или пароль.")
+    if duration is not None and duration <= 0:
+        raise ValueError(f"Строка {number}: продолжительность должна быть больше нуля.")
+    if engine is not None and engine not in ENGINES:
+        raise ValueError(f"Строка {number}: неизвестный движок {engine}.")
+    return user_id, username, password, duration, engine
+
+# Parse an uploaded CSV (with a header row) or JSON (a list of objects) file into user rows
+def parse_users(filename, data):
+    text = data.decode("utf-8-sig")
+    if filename.lower().endswith(".json"):
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            raise ValueError(f"Некорректный JSON: {e}")
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValueError("JSON должен быть списком объектов.")
+        first = 1
+    elif filename.lower().endswith(".csv"):
+        records = list(csv.DictReader(io.StringIO(text)))
+        first = 2  # Line numbers as seen in the file, after the header
+    else:
+        raise ValueError("Поддерживаются только файлы .csv и .json.")
+    if not records:
+        raise ValueError("Файл не содержит пользователей.")
+    return [_row(record, number) for number, record in enumerate(records, first)]
+
+# Serialise user rows for /export
+def dump_users(rows, fmt="csv"):
+    if fmt == "json":
+        return json.dumps([dict(zip(COLUMNS, row)) for row in rows], ensure_ascii=False, indent=2).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
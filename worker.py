@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Load environment variables from .env file (before the modules below read their settings)
+load_dotenv()
+
+from db import init_db, get_user_credentials, get_user_engine
+from browser import BrowserPool, POOL_SIZE
+from supervisor import run_attendance
+from multiplexer import close_multiplexer
+from job_queue import get_job_queue, LEASE_SECONDS
+from admission import AdmissionController
+import metrics
+
+# Configuration Constants
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+WORKER_SLOTS = int(os.getenv("WORKER_SLOTS", "4"))  # Jobs this worker runs at once
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3
+POLL_INTERVAL = 2
+
+shutting_down = threading.Event()
+running_jobs = {}  # job_id -> stop event
+admission = AdmissionController(WORKER_SLOTS)  # Jobs are only claimed while the host has memory and CPU to spare
+
+# Renew the job's lease until the session ends; stop the session if the lease is lost or the job cancelled
+def keep_lease(job_queue, job_id, stop_event, done_event):
+    while not done_event.wait(HEARTBEAT_INTERVAL):
+        try:
+            if not job_queue.heartbeat(job_id, WORKER_ID):
+                stop_event.set()
+                return
+        except Exception as e:
+            print(f"Heartbeat for job {job_id} failed: {e}")
+
+# Run one claimed job to completion
+def run_job(job_queue, browser_pool, job):
+    job_id, user_id, deadline = job
+    credentials = get_user_credentials(user_id)
+    if credentials is None:
+        admission.finished(job_id)
+        job_queue.finish(job_id, WORKER_ID, "failed")
+        return
+    username, password, _ = credentials
+    stop_event = threading.Event()
+    done_event = threading.Event()
+    running_jobs[job_id] = stop_event
+    threading.Thread(target=keep_lease, args=(job_queue, job_id, stop_event, done_event), daemon=True).start()
+    status = "done"
+    engine = get_user_engine(user_id)
+    admission.started(job_id, engine)
+    try:
+        minutes_left = max(0, (deadline - time.time()) / 60)
+        run_attendance(
+            browser_pool, engine, username, password, minutes_left, user_id, os.getenv("API_TOKEN"), stop_event,
+            on_browser=lambda pids: admission.set_browsers(job_id, pids),
+        )
+    except Exception as e:
+        print(f"Error in job {job_id}: {e}")
+        status = "failed"
+    finally:
+        done_event.set()
+        admission.finished(job_id)
+        running_jobs.pop(job_id, None)
+        # Jobs interrupted by a worker shutdown go back to the queue for the time they have left
+        job_queue.finish(job_id, WORKER_ID, "queued" if shutting_down.is_set() else status)
+
+# Container stops send SIGTERM; treat it like Ctrl+C so running jobs go back to the queue
+def handle_sigterm(signum, frame):
+    print("Worker stopping.")
+    shutting_down.set()
+
+# Claim jobs whenever a slot is free
+def main():
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    init_db()
+    if metrics.METRICS_PORT:
+        metrics.serve()
+    job_queue = get_job_queue()
+    browser_pool = BrowserPool() if POOL_SIZE > 0 else None
+    if browser_pool is not None:
+        browser_pool.fill()
+    slots = threading.BoundedSemaphore(WORKER_SLOTS)
+    executor = ThreadPoolExecutor(max_workers=WORKER_SLOTS, thread_name_prefix="job")
+
+    def release_slot(future):
+        slots.release()
+
+    print(f"Worker {WORKER_ID} started with {WORKER_SLOTS} slots.")
+    try:
+        while not shutting_down.is_set():
+            if not slots.acquire(timeout=POLL_INTERVAL):
+                continue
+            if not admission.has_capacity():
+                # Leave the job to a worker with room; it is claimed here once memory or CPU frees up
+                slots.release()
+                shutting_down.wait(POLL_INTERVAL)
+                continue
+            try:
+                job = job_queue.claim(WORKER_ID)
+            except Exception as e:
+                print(f"Error claiming job: {e}")
+                job = None
+            if job is None:
+                slots.release()
+                shutting_down.wait(POLL_INTERVAL)
+                continue
+            admission.started(job[0], "selenium")  # Counted before the engine is known, so the next claim sees it
+            executor.submit(run_job, job_queue, browser_pool, job).add_done_callback(release_slot)
+    except KeyboardInterrupt:
+        print("Worker stopping.")
+    finally:
+        shutting_down.set()
+        for stop_event in list(running_jobs.values()):
+            stop_event.set()
+        close_multiplexer()
+        executor.shutdown(wait=True)
+        if browser_pool is not None:
+            browser_pool.close()
+
+# Entry point of the script
+if __name__ == "__main__":
+    sys.exit(main())